@@ -1,27 +1,164 @@
 """Defining agents and graph"""
 
-from typing import Dict, List, Any, Annotated, TypedDict
+import operator
+from typing import Callable, Dict, Iterator, List, Any, Annotated, Optional, Tuple, TypedDict, Union
 from langgraph.graph import StateGraph, END
-from langgraph.graph.message import add_messages
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
 import time
+import queue
+import threading
+import uuid
+from collections import OrderedDict
 from datetime import datetime
-from config import LLMConfig
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config import (LLMConfig, RouterConfig, CoalescingConfig, ResilienceConfig, DeadlineConfig, ToolConfig,
+                    ProfilingConfig, WorkerConfig, LedgerConfig)
+from routing import (VALID_CATEGORIES, MULTI_INTENT_REGEX, parse_category, parse_intents, classify_by_keywords,
+                     match_categories)
+from singleflight import SingleFlight, CoalescedChain, normalize_query
+from resilience import AdaptiveLimiter, LatencyWindow, ResilientChain, attempt_timeout
+from profiling import RequestProfiler, attributed_node, propagate
+from prompts import PromptCacheAccounting, build_prompt
+from ledger import TokenLedger
+from cassette import CassetteChatModel
 from tools import tools, search_knowledge_base, execute_python_code, create_study_plan
 from memory import SessionMemorySystem
 
+def merge_unique(left: List[str], right: List[str]) -> List[str]:
+    """Reducer appending only new items (parallel specialists may report the same stage)"""
+    return left + [item for item in right if item not in left]
+
+class TokenForwarder(BaseCallbackHandler):
+    """Forwards answer tokens of an agent's LLM call to a stream consumer
+    
+    Only the first attempt emitting tokens is forwarded (a hedged duplicate is not); when that attempt
+    fails, sink receives None and the tokens of the next attempt follow.
+    """
+    
+    def __init__(self, agent: str, sink: Callable[[str, Optional[str]], None]):
+        self.agent = agent
+        self.sink = sink
+        self._run_id = None
+        self._lock = threading.Lock()
+    
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs: Any) -> None:
+        with self._lock:
+            if self._run_id is None:
+                self._run_id = run_id
+            elif self._run_id != run_id:
+                return
+        if token:
+            self.sink(self.agent, token)
+    
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        with self._lock:
+            if self._run_id != run_id:
+                return
+            self._run_id = None
+        self.sink(self.agent, None)
+
 class AgentState(TypedDict):
     """State of the multi-agent system"""
-    messages: Annotated[List[Dict], add_messages]  # Message history
     current_agent: str  # Current active agent
-    agent_history: List[str]  # History of activated agents
-    tools_used: List[str]  # History of used tools
+    agent_history: Annotated[List[str], operator.add]  # History of activated agents
+    tools_used: Annotated[List[str], operator.add]  # History of used tools
     query: str  # Original user query
-    category: str  # Query category
+    category: str  # Query category (primary one for mixed-intent queries)
+    categories: List[str]  # All query categories, in the order they were asked
+    answers: Annotated[List[Dict[str, Any]], operator.add]  # Specialist answers, merged by join node
     final_answer: str  # Final answer
-    memory: Dict[str, Any]  # Session memory
     execution_time: float  # Execution time
+    deadline: float  # Request deadline (time.monotonic() timestamp)
+    degraded_stages: Annotated[List[str], merge_unique]  # Stages degraded because of the deadline
+    session_id: Optional[str]  # Session whose memory holds the history (None: default session)
+    request_id: str  # Identifies the request's LLM calls in the token ledger
+    context: str  # History context, read from session memory when the request starts
+
+# Graph node handling each category
+CATEGORY_NODES = {"theory": "theory", "code": "code", "planning": "planner", "general": "general"}
+NODE_CATEGORIES = {node: category for category, node in CATEGORY_NODES.items()}
+
+class ProcessResult:
+    """Result of MultiAgentSystem.process; formatted text and memory stats are built on first access"""
+    
+    __slots__ = ("query", "category", "categories", "agent", "agents_used", "tools_used", "response",
+                 "agent_execution_time", "total_execution_time", "degraded_stages", "finished_at",
+                 "profile", "_system", "_memory", "_checkpoint", "_formatted", "_memory_stats")
+    
+    # Keys available through dict-style access
+    KEYS = ("query", "category", "categories", "agent", "agents_used", "tools_used", "response",
+            "agent_execution_time", "total_execution_time", "degraded", "degraded_stages",
+            "formatted", "memory_stats", "profile")
+    
+    def __init__(self, system: "MultiAgentSystem", query: str, state: Dict[str, Any],
+                 total_execution_time: float, memory: Optional[SessionMemorySystem] = None):
+        self.query = query
+        self.category = state["category"]
+        self.categories = state["categories"]
+        self.agent = state["current_agent"]
+        self.agents_used = state["agent_history"]
+        self.tools_used = state["tools_used"]
+        self.response = state["final_answer"]
+        self.agent_execution_time = state["execution_time"]
+        self.total_execution_time = total_execution_time
+        self.degraded_stages = state["degraded_stages"]
+        self.finished_at = time.time()
+        self.profile = None  # Profiling summary when the request was profiled
+        self._system = system
+        self._memory = memory if memory is not None else system.memory
+        # Session state as of this request: a result formatted later does not report later interactions
+        self._checkpoint = self._memory.checkpoint()
+        self._formatted = None
+        self._memory_stats = None
+    
+    @property
+    def degraded(self) -> bool:
+        return bool(self.degraded_stages)
+    
+    @property
+    def memory_stats(self) -> Dict[str, Any]:
+        """Session statistics as of this request, computed on first access"""
+        if self._memory_stats is None:
+            self._memory_stats = self._memory.get_statistics(self._checkpoint)
+        return self._memory_stats
+    
+    @property
+    def formatted(self) -> str:
+        """Formatted report, built on first access"""
+        if self._formatted is None:
+            self._formatted = self._system._format_response(self)
+        return self._formatted
+    
+    # Dict-style access for callers of the former dict result
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.KEYS
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self.KEYS else default
+    
+    def keys(self):
+        return iter(self.KEYS)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns all fields as a dict (builds formatted text and memory stats)"""
+        return {key: self[key] for key in self.KEYS}
+    
+    def __repr__(self) -> str:
+        return f"ProcessResult(category={self.category!r}, agent={self.agent!r}, response={self.response[:40]!r})"
+
+# Returned instead of the specialist answer when the deadline is hit
+DEGRADED_ANSWER = ("The full answer could not be produced within the time limit. "
+                   "Please try again or ask a narrower question.")
+
+# Prompt filler when no tool output reached the prompt in time
+NO_FACTS = "none"
 
 class MultiAgentSystem:
     """Multi-agent system with 5 agents"""
@@ -33,13 +170,66 @@ class MultiAgentSystem:
         self.llm = LLMConfig.get_llm()
         self.memory = SessionMemorySystem()
         
+        # Memory of named sessions (least recently used are dropped above WorkerConfig.MAX_SESSIONS)
+        self.sessions: OrderedDict = OrderedDict()
+        
+        # Concurrent identical requests share one LLM call
+        self.flight = SingleFlight(max_workers=CoalescingConfig.MAX_WORKERS)
+        
+        # Shared client-side concurrency limit for the LLM backend
+        self.limiter = AdaptiveLimiter(
+            initial=ResilienceConfig.LIMIT_INITIAL,
+            min_limit=ResilienceConfig.LIMIT_MIN,
+            max_limit=ResilienceConfig.LIMIT_MAX,
+            latency_tolerance=ResilienceConfig.LATENCY_TOLERANCE
+        )
+        self.hedge_executor = ThreadPoolExecutor(max_workers=ResilienceConfig.LIMIT_MAX, thread_name_prefix="hedge")
+        self.resilient_agents: Dict[str, ResilientChain] = {}
+        
+        # Deadline handling: recent router decisions for fallback and per-stage hit counters
+        self.router_cache: OrderedDict = OrderedDict()
+        self.deadline_hits: Dict[str, int] = {}
+        self.router_cache_stats = {"hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+        
+        # Token consumers of streamed requests, by request id
+        self._token_sinks: Dict[str, Callable[[str, Optional[str]], None]] = {}
+        
+        # Recent latency of each graph node
+        self.node_latency: Dict[str, LatencyWindow] = {}
+        
+        # Deterministic tools run concurrently with the LLM call
+        self.tool_executor = ThreadPoolExecutor(max_workers=ToolConfig.MAX_WORKERS, thread_name_prefix="tool")
+        
+        # Opt-in per-request profiling
+        self.profiler = RequestProfiler(
+            mode=ProfilingConfig.MODE,
+            rate=ProfilingConfig.RATE,
+            output_dir=ProfilingConfig.DIR,
+            keep=ProfilingConfig.KEEP,
+            interval=ProfilingConfig.INTERVAL
+        )
+        
+        # Prompt and cached prompt tokens reported by the backend, per agent
+        self.prompt_cache = PromptCacheAccounting()
+        
+        # Tokens and latency of every LLM call
+        self.ledger = TokenLedger(
+            directory=LedgerConfig.DIR,
+            max_bytes=LedgerConfig.MAX_BYTES,
+            backups=LedgerConfig.BACKUPS,
+            batch_size=LedgerConfig.BATCH,
+            prices=LedgerConfig.PRICES,
+            enabled=LedgerConfig.ENABLED
+        )
+        
         # Create agents
         print("  Creating agents...")
-        self.router_agent = self._create_router_agent()
-        self.theory_agent = self._create_theory_agent()
-        self.code_agent = self._create_code_agent()
-        self.planner_agent = self._create_planner_agent()
-        self.general_agent = self._create_general_agent()
+        self.router_agent = self._wrap_agent("router", self._create_router_agent())
+        self.theory_agent = self._wrap_agent("theory", self._create_theory_agent())
+        self.code_agent = self._wrap_agent("code", self._create_code_agent())
+        self.planner_agent = self._wrap_agent("planner", self._create_planner_agent())
+        self.general_agent = self._wrap_agent("general", self._create_general_agent())
         
         # Create graph
         print("  Building LangGraph...")
@@ -47,120 +237,77 @@ class MultiAgentSystem:
         
         print("Multi-agent system initialized\n")
     
+    def _wrap_agent(self, name: str, chain):
+        """Wraps agent chain with resilience and in-flight request coalescing"""
+        chain = ResilientChain(
+            name, chain, self.limiter, self.hedge_executor,
+            retries=ResilienceConfig.RETRIES,
+            backoff_base=ResilienceConfig.BACKOFF_BASE,
+            backoff_cap=ResilienceConfig.BACKOFF_CAP,
+            hedge=ResilienceConfig.HEDGE,
+            hedge_percentile=ResilienceConfig.HEDGE_PERCENTILE,
+            attempt_timeout=ResilienceConfig.ATTEMPT_TIMEOUT
+        )
+        self.resilient_agents[name] = chain
+        if not CoalescingConfig.ENABLED:
+            return chain
+        return CoalescedChain(name, chain, self.flight)
+    
+    def _agent_llm(self, name: str):
+        """Returns LLM tagged with the agent name, reporting token usage to prompt cache accounting and the ledger"""
+        llm = self.llm.with_config(metadata={"agent": name},
+                                   callbacks=[self.prompt_cache.handler(name), self.ledger.handler(name)])
+        
+        def call(messages, config, **kwargs):
+            # The HTTP call of each attempt ends by the request deadline, so a hung call frees its slot
+            timeout = attempt_timeout()
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            # Streamed requests generate token by token; usage then comes with the last chunk
+            if (config.get("metadata") or {}).get("stream_tokens"):
+                kwargs.update(stream=True, stream_usage=True)
+            return llm.invoke(messages, config, **kwargs)
+        
+        return RunnableLambda(call, name=f"{name}_llm")
+    
     def _create_router_agent(self):
         """Creates router agent"""
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an intelligent router of the StudyCoder Assistant multi-agent system.
-            Your task is to classify user queries into one of categories.
-            
-            Categories:
-            1. theory - theoretical questions (what is, explain, definition, concept)
-            2. code - programming questions (write code, function, fix error, how to do)
-            3. planning - planning questions (create plan, schedule, organize, plan)
-            4. general - general questions (hello, help, information, system capabilities)
-            
-            Return ONLY one word: theory, code, planning or general.
-            Do not add any explanations.
-            
-            Examples:
-            - "What is Python?" → theory
-            - "Write factorial function" → code
-            - "Create learning plan for a week" → planning
-            - "Hello, tell about yourself" → general
-            """),
-            ("human", "{query}")
-        ])
+        prompt = build_prompt("router_multi" if RouterConfig.MULTI_INTENT else "router",
+                              system_suffix="/no_think" if RouterConfig.MODE == "constrained" else "")
+        llm = self._agent_llm("router")
         
-        return prompt | self.llm | StrOutputParser()
+        if RouterConfig.MODE != "constrained":
+            return prompt | llm | StrOutputParser()
+        
+        # Cap generation to a few tokens and request enum output where supported
+        if RouterConfig.MULTI_INTENT:
+            decoding = {
+                "max_tokens": RouterConfig.MULTI_INTENT_MAX_TOKENS,
+                "stop": [stop for stop in RouterConfig.STOP if stop != ","]
+            }
+            guided = {"guided_regex": MULTI_INTENT_REGEX}
+        else:
+            decoding = {"max_tokens": RouterConfig.MAX_TOKENS, "stop": RouterConfig.STOP}
+            guided = {"guided_choice": VALID_CATEGORIES}
+        if RouterConfig.GUIDED_CHOICE:
+            decoding["extra_body"] = guided
+        return prompt | llm.bind(**decoding) | StrOutputParser()
     
     def _create_theory_agent(self):
         """Creates theory agent"""
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert in programming theory, algorithms and computer science.
-            
-            Your tasks:
-            1. Explain concepts clearly and in detail
-            2. Use examples and analogies
-            3. Structure response (introduction, main part, conclusion)
-            4. Highlight key terms
-            5. Give practical recommendations
-            
-            Previous discussion context: {context}
-            
-            Use search_knowledge_base tool to find accurate information.
-            If information is insufficient, supplement with your knowledge.
-            """),
-            ("human", "{query}")
-        ])
-        
-        return prompt | self.llm | StrOutputParser()
+        return build_prompt("theory") | self._agent_llm("theory") | StrOutputParser()
     
     def _create_code_agent(self):
         """Creates code agent"""
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an experienced programmer assistant, Python expert.
-            
-            Response requirements:
-            1. Provide complete, working code
-            2. Add comments for explanation
-            3. Explain logic and key points
-            4. Consider best practices (PEP 8)
-            5. Warn about possible errors
-            6. Suggest alternative solutions
-            
-            Previous discussion context: {context}
-            
-            Use execute_python_code tool to test code.
-            Show code execution results to user.
-            """),
-            ("human", "{query}")
-        ])
-        
-        return prompt | self.llm | StrOutputParser()
+        return build_prompt("code") | self._agent_llm("code") | StrOutputParser()
     
     def _create_planner_agent(self):
         """Creates planner agent"""
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert in planning and time management.
-            
-            Your tasks:
-            1. Create realistic and achievable plans
-            2. Break big goals into small steps
-            3. Consider time constraints
-            4. Add time for rest and review
-            5. Suggest productivity methods (Pomodoro, Eisenhower Matrix)
-            
-            Previous discussion context: {context}
-            
-            Use create_study_plan tool to create structured plans.
-            Adapt plan to specific user needs.
-            """),
-            ("human", "{query}")
-        ])
-        
-        return prompt | self.llm | StrOutputParser()
+        return build_prompt("planner") | self._agent_llm("planner") | StrOutputParser()
     
     def _create_general_agent(self):
         """Creates general agent"""
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a friendly and helpful assistant of StudyCoder Assistant multi-agent system.
-            
-            System information:
-            - Name: StudyCoder Assistant
-            - 5 specialized agents: Router, Theory, Code, Planner, General
-            - 3 tools: code execution, knowledge search, plan creation
-            - Memory: saves interaction history
-            - Uses model: qwen3-32b via LiteLLM server
-            
-            Previous discussion context: {context}
-            
-            Be polite, helpful and informative.
-            If question is not in your specialization, suggest contacting appropriate agent.
-            """),
-            ("human", "{query}")
-        ])
-        
-        return prompt | self.llm | StrOutputParser()
+        return build_prompt("general") | self._agent_llm("general") | StrOutputParser()
     
     def _build_graph(self):
         """Builds LangGraph"""
@@ -173,23 +320,29 @@ class MultiAgentSystem:
             
             print(f"\n [Router] Analyzing query: '{state['query'][:50]}...'")
             
-            # Get category from router
-            category = self.router_agent.invoke({"query": state["query"]})
-            category = category.strip().lower()
-            
-            # Category validation
-            valid_categories = ["theory", "code", "planning", "general"]
-            if category not in valid_categories:
-                category = "general"
+            # Get categories from router, falling back to cached/local decision near the deadline
+            degraded_stages = []
+            remaining = self._remaining(state)
+            try:
+                if remaining < DeadlineConfig.ROUTER_MIN_BUDGET:
+                    raise FutureTimeoutError()
+                categories = self.classify_all(state["query"], self._call_config(state, "router"),
+                                              timeout=remaining * DeadlineConfig.ROUTER_BUDGET_SHARE)
+            except FutureTimeoutError:
+                self._deadline_hit("router")
+                categories = self._fallback_categories(state["query"])
+                degraded_stages.append("router")
             
             execution_time = time.time() - start_time
-            print(f"  Category determined: {category} ({execution_time:.2f} sec)")
+            self._record_node_latency("router", execution_time)
+            print(f"  Category determined: {', '.join(categories)} ({execution_time:.2f} sec)")
             
             return {
-                "category": category,
+                "category": categories[0],
+                "categories": categories,
                 "current_agent": "router",
                 "agent_history": ["router"],
-                "tools_used": [],
+                "degraded_stages": degraded_stages,
                 "execution_time": execution_time
             }
         
@@ -200,32 +353,44 @@ class MultiAgentSystem:
             
             print(f" [Theory Agent] Processing theoretical question")
             
-            # Get context from memory
-            context = self.memory.get_context(2)
+            context = state["context"]
+            
+            # Start knowledge search tool if needed, so the prompt can use its result
+            tools_used = []
+            degraded_stages = []
+            knowledge, knowledge_future = None, None
+            knowledge_args = {"topic": state["query"]}
+            wants_knowledge = (
+                any(keyword in state["query"].lower() for keyword in ["what is", "explain", "definition"])
+                and self._tools_allowed(state, degraded_stages)
+            )
+            if wants_knowledge:
+                knowledge_future = self._start_tool(search_knowledge_base, knowledge_args)
+                knowledge = self._wait_tool(knowledge_future, ToolConfig.PREFETCH_WAIT)
             
             # Process query
-            response = self.theory_agent.invoke({
+            response = self._run_agent("theory", self.theory_agent, {
                 "query": state["query"],
-                "context": context
-            })
-            
-            # Use knowledge search tool if needed
-            tools_used = []
-            if any(keyword in state["query"].lower() for keyword in ["what is", "explain", "definition"]):
-                knowledge = search_knowledge_base.invoke({"topic": state["query"]})
-                response += f"\n\n Additional information:\n{knowledge}"
+                "context": context,
+                "facts": knowledge or NO_FACTS
+            }, state)
+            if response is None:
+                degraded_stages.append("theory")
+                response = DEGRADED_ANSWER
+            
+            # Append tool output the model has not seen
+            if wants_knowledge and knowledge is None:
+                knowledge = (self._wait_tool(knowledge_future, self._remaining(state)) if knowledge_future
+                             else search_knowledge_base.invoke(knowledge_args))
+                if knowledge:
+                    response += f"\n\n Additional information:\n{knowledge}"
+            if knowledge:
                 tools_used.append("search_knowledge_base")
             
             execution_time = time.time() - start_time
             print(f" Completed ({execution_time:.2f} sec). Tools: {tools_used}")
             
-            return {
-                "current_agent": "theory",
-                "agent_history": state["agent_history"] + ["theory"],
-                "tools_used": state["tools_used"] + tools_used,
-                "final_answer": response,
-                "execution_time": execution_time
-            }
+            return self._specialist_update("theory", response, tools_used, degraded_stages, execution_time)
         
         def code_node(state: AgentState) -> Dict:
             """Code agent node"""
@@ -234,18 +399,22 @@ class MultiAgentSystem:
             
             print(f" [Code Agent] Processing programming query")
             
-            # Get context from memory
-            context = self.memory.get_context(2)
+            context = state["context"]
             
             # Process query
-            response = self.code_agent.invoke({
+            response = self._run_agent("code", self.code_agent, {
                 "query": state["query"],
                 "context": context
-            })
+            }, state)
+            degraded_stages = []
+            if response is None:
+                degraded_stages.append("code")
+                response = DEGRADED_ANSWER
             
             # Try to execute code if present
             tools_used = []
-            if "```python" in response or "def " in response:
+            if (("```python" in response or "def " in response)
+                    and self._tools_allowed(state, degraded_stages)):
                 # Extract code
                 code_to_execute = ""
                 if "```python" in response:
@@ -266,13 +435,7 @@ class MultiAgentSystem:
             execution_time = time.time() - start_time
             print(f" Completed ({execution_time:.2f} sec). Tools: {tools_used}")
             
-            return {
-                "current_agent": "code",
-                "agent_history": state["agent_history"] + ["code"],
-                "tools_used": state["tools_used"] + tools_used,
-                "final_answer": response,
-                "execution_time": execution_time
-            }
+            return self._specialist_update("code", response, tools_used, degraded_stages, execution_time)
         
         def planner_node(state: AgentState) -> Dict:
             """Planner agent node"""
@@ -281,42 +444,59 @@ class MultiAgentSystem:
             
             print(f" [Planner Agent] Processing planning query")
             
-            # Get context from memory
-            context = self.memory.get_context(2)
+            context = state["context"]
             
-            # Process query
-            response = self.planner_agent.invoke({
-                "query": state["query"],
-                "context": context
-            })
-            
-            # Use plan creation tool
+            # Start plan creation tool if needed, so the prompt can use its result
             tools_used = []
-            if any(keyword in state["query"].lower() for keyword in ["plan", "schedule", "days", "weeks"]):
+            degraded_stages = []
+            plan, plan_future, plan_error = None, None, None
+            wants_plan = (
+                any(keyword in state["query"].lower() for keyword in ["plan", "schedule", "days", "weeks"])
+                and self._tools_allowed(state, degraded_stages)
+            )
+            if wants_plan:
                 # Extract number of days
                 days = 7
                 for word in state["query"].split():
                     if word.isdigit():
                         days = min(int(word), 30)
                         break
+                plan_args = {"days": days, "topic": state["query"]}
                 
+                plan_future = self._start_tool(create_study_plan, plan_args)
+                try:
+                    plan = self._wait_tool(plan_future, ToolConfig.PREFETCH_WAIT)
+                except Exception as e:
+                    plan_error = e
+            
+            # Process query
+            response = self._run_agent("planner", self.planner_agent, {
+                "query": state["query"],
+                "context": context,
+                "facts": plan or NO_FACTS
+            }, state)
+            if response is None:
+                degraded_stages.append("planner")
+                response = DEGRADED_ANSWER
+            
+            # Append tool output the model has not seen
+            if wants_plan and plan is None and plan_error is None:
                 try:
-                    plan = create_study_plan.invoke({"days": days, "topic": state["query"]})
-                    response += f"\n\n📋 Structured plan:\n{plan}"
-                    tools_used.append("create_study_plan")
+                    plan = (self._wait_tool(plan_future, self._remaining(state)) if plan_future
+                            else create_study_plan.invoke(plan_args))
+                    if plan:
+                        response += f"\n\n📋 Structured plan:\n{plan}"
                 except Exception as e:
-                    response += f"\n\n Failed to create detailed plan: {str(e)}"
+                    plan_error = e
+            if plan_error is not None:
+                response += f"\n\n Failed to create detailed plan: {str(plan_error)}"
+            if plan:
+                tools_used.append("create_study_plan")
             
             execution_time = time.time() - start_time
             print(f" Completed ({execution_time:.2f} sec). Tools: {tools_used}")
             
-            return {
-                "current_agent": "planner",
-                "agent_history": state["agent_history"] + ["planner"],
-                "tools_used": state["tools_used"] + tools_used,
-                "final_answer": response,
-                "execution_time": execution_time
-            }
+            return self._specialist_update("planner", response, tools_used, degraded_stages, execution_time)
         
         def general_node(state: AgentState) -> Dict:
             """General agent node"""
@@ -325,35 +505,54 @@ class MultiAgentSystem:
             
             print(f" [General Agent] Processing general query")
             
-            # Get context from memory
-            context = self.memory.get_context(2)
+            context = state["context"]
             
             # Process query
-            response = self.general_agent.invoke({
+            response = self._run_agent("general", self.general_agent, {
                 "query": state["query"],
                 "context": context
-            })
+            }, state)
+            degraded_stages = []
+            if response is None:
+                degraded_stages.append("general")
+                response = DEGRADED_ANSWER
             
             execution_time = time.time() - start_time
             print(f" Completed ({execution_time:.2f} sec)")
             
+            return self._specialist_update("general", response, [], degraded_stages, execution_time)
+        
+        def join_node(state: AgentState) -> Dict:
+            """Join node - merges specialist answers in the order categories were asked"""
+            order = [CATEGORY_NODES[category] for category in state["categories"]]
+            answers = sorted(state["answers"], key=lambda answer: order.index(answer["agent"]))
+            if "tools" in state["degraded_stages"]:
+                self._deadline_hit("tools")
+            
+            if len(answers) == 1:
+                final_answer = answers[0]["answer"]
+            else:
+                final_answer = "\n\n".join(
+                    f"[{answer['agent'].capitalize()} Agent]\n{answer['answer']}" for answer in answers
+                )
+            
             return {
-                "current_agent": "general",
-                "agent_history": state["agent_history"] + ["general"],
-                "tools_used": state["tools_used"],
-                "final_answer": response,
-                "execution_time": execution_time
+                "current_agent": "+".join(answer["agent"] for answer in answers),
+                "final_answer": final_answer,
+                # Specialists run in parallel: wall time is the slowest one
+                "execution_time": max(answer["execution_time"] for answer in answers)
             }
         
         # Create graph
         workflow = StateGraph(AgentState)
         
         # Add nodes
-        workflow.add_node("router", router_node)
-        workflow.add_node("theory", theory_node)
-        workflow.add_node("code", code_node)
-        workflow.add_node("planner", planner_node)
-        workflow.add_node("general", general_node)
+        workflow.add_node("router", attributed_node(router_node))
+        workflow.add_node("theory", attributed_node(theory_node))
+        workflow.add_node("code", attributed_node(code_node))
+        workflow.add_node("planner", attributed_node(planner_node))
+        workflow.add_node("general", attributed_node(general_node))
+        workflow.add_node("join", attributed_node(join_node))
         
         # Set entry point
         workflow.set_entry_point("router")
@@ -365,51 +564,257 @@ class MultiAgentSystem:
                 state["category"] = "general"
             return state
         
-        # Add conditional edges
+        # Add conditional edges (several categories fan out to specialists in parallel)
         workflow.add_conditional_edges(
             "router",
-            lambda state: state["category"],
-            {
-                "theory": "theory",
-                "code": "code",
-                "planning": "planner",
-                "general": "general"
-            }
+            lambda state: [CATEGORY_NODES[category] for category in state["categories"]],
+            ["theory", "code", "planner", "general"]
         )
         
         # Add end points
-        workflow.add_edge("theory", END)
-        workflow.add_edge("code", END)
-        workflow.add_edge("planner", END)
-        workflow.add_edge("general", END)
+        workflow.add_edge("theory", "join")
+        workflow.add_edge("code", "join")
+        workflow.add_edge("planner", "join")
+        workflow.add_edge("general", "join")
+        workflow.add_edge("join", END)
         
         return workflow.compile()
     
-    def process(self, query: str) -> Dict[str, Any]:
-        """Processes query through multi-agent system"""
-        import time
+    def classify(self, query: str, config: Optional[Dict] = None, timeout: Optional[float] = None) -> str:
+        """Classifies query with the router agent (primary category)"""
+        return self.classify_all(query, config, timeout)[0]
+    
+    def classify_all(self, query: str, config: Optional[Dict] = None,
+                     timeout: Optional[float] = None) -> List[str]:
+        """Classifies query with the router agent (all categories of a mixed-intent query)"""
+        output = self.router_agent.invoke({"query": query}, config, timeout=timeout)
+        
+        # Category validation
+        if RouterConfig.MODE == "constrained":
+            categories = parse_intents(output) if RouterConfig.MULTI_INTENT else [parse_category(output)]
+        else:
+            category = output.strip().lower()
+            categories = [category if category in VALID_CATEGORIES else "general"]
+        
+        # Remember decision for deadline fallback
+        with self._stats_lock:
+            self.router_cache[normalize_query(query)] = categories
+            self.router_cache.move_to_end(normalize_query(query))
+            if len(self.router_cache) > DeadlineConfig.ROUTER_CACHE_SIZE:
+                self.router_cache.popitem(last=False)
+        return categories
+    
+    def _fallback_categories(self, query: str) -> List[str]:
+        """Returns cached router decision or local keyword classification"""
+        with self._stats_lock:
+            cached = self.router_cache.get(normalize_query(query))
+            self.router_cache_stats["hits" if cached else "misses"] += 1
+        if cached:
+            return cached
+        # Keep fan-out for mixed-intent queries when the router is skipped
+        if RouterConfig.MULTI_INTENT:
+            return match_categories(query) or [classify_by_keywords(query)]
+        return [classify_by_keywords(query)]
+    
+    def _record_node_latency(self, node: str, seconds: float):
+        """Records node latency for performance statistics"""
+        window = self.node_latency.get(node)
+        if window is None:
+            window = self.node_latency.setdefault(node, LatencyWindow())
+        window.add(seconds)
+    
+    def _specialist_update(self, agent: str, response: str, tools_used: List[str],
+                           degraded_stages: List[str], execution_time: float) -> Dict:
+        """Builds specialist node state update (merged by join node)"""
+        self._record_node_latency(agent, execution_time)
+        return {
+            "agent_history": [agent],
+            "tools_used": tools_used,
+            "degraded_stages": degraded_stages,
+            "answers": [{"agent": agent, "answer": response, "execution_time": execution_time}]
+        }
+    
+    def _remaining(self, state: AgentState) -> float:
+        """Returns seconds left until the request deadline"""
+        return state["deadline"] - time.monotonic()
+    
+    def _deadline_hit(self, stage: str):
+        """Counts a deadline hit for stage"""
+        with self._stats_lock:
+            self.deadline_hits[stage] = self.deadline_hits.get(stage, 0) + 1
+    
+    def _call_config(self, state: AgentState, stage: str) -> Dict[str, Any]:
+        """Run config attributing an agent's LLM calls to request, session and category"""
+        return {"metadata": {
+            "request_id": state["request_id"],
+            "session_id": state["session_id"] or "default",
+            "category": NODE_CATEGORIES.get(stage, "")
+        }}
+    
+    def _run_agent(self, stage: str, agent, inputs: Dict[str, Any], state: AgentState) -> Optional[str]:
+        """Invokes specialist agent within the request budget; returns None on deadline hit"""
+        remaining = self._remaining(state)
+        config = self._call_config(state, stage)
+        sink = self._token_sinks.get(state["request_id"])
+        if sink is not None:
+            # A coalesced call streams to the request that started it only, so streamed answers are not shared
+            agent = self.resilient_agents[stage]
+            config["metadata"]["stream_tokens"] = True
+            config["callbacks"] = [TokenForwarder(stage, sink)]
+        try:
+            if remaining <= 0:
+                raise FutureTimeoutError()
+            return agent.invoke(inputs, config, timeout=remaining)
+        except FutureTimeoutError:
+            self._deadline_hit(stage)
+            return None
+    
+    def _start_tool(self, tool, args: Dict[str, Any]) -> Optional[Future]:
+        """Starts deterministic tool concurrently with the LLM call (None in sequential mode)"""
+        if not ToolConfig.PREFETCH:
+            return None
+        return self.tool_executor.submit(propagate(tool.invoke), args)
+    
+    def _wait_tool(self, future: Optional[Future], timeout: Optional[float]) -> Optional[str]:
+        """Returns tool output if it is ready within timeout (None waits until the tool finishes)"""
+        if future is None:
+            return None
+        try:
+            return future.result(None if timeout is None else max(timeout, 0))
+        except FutureTimeoutError:
+            return None
+    
+    def _tools_allowed(self, state: AgentState, degraded_stages: List[str]) -> bool:
+        """Checks whether there is budget left for optional tool augmentation"""
+        if self._remaining(state) >= DeadlineConfig.TOOL_RESERVE:
+            return True
+        # Counted once per request by the join node
+        degraded_stages.append("tools")
+        return False
+    
+    def process(self, query: str, timeout: Optional[float] = None,
+                profile: Union[bool, str, None] = None, session_id: Optional[str] = None) -> ProcessResult:
+        """Processes query through multi-agent system within timeout seconds
+        
+        profile: True or "sample"/"cprofile" profiles this request; None follows PROFILE_RATE, False never profiles
+        session_id: session whose memory provides context and stores the interaction
+        """
+        # Plain path costs one check when profiling is off
+        if profile or self.profiler.rate:
+            mode = self.profiler.choose_mode(profile)
+            if mode:
+                result, summary = self.profiler.run(mode, query, lambda: self._process(query, timeout, session_id))
+                result.profile = summary
+                print(f" Profile ({mode}) written: {', '.join(summary['files'])}")
+                return result
+        return self._process(query, timeout, session_id)
+    
+    def _process(self, query: str, timeout: Optional[float], session_id: Optional[str] = None) -> ProcessResult:
+        """Runs the graph for query and saves the interaction"""
         total_start_time = time.time()
         
         print(f"\n Starting query processing: '{query}'")
         
+        # Execute graph
+        result = self.graph.invoke(self._initial_state(query, timeout, session_id))
+        return self._finish(query, result, total_start_time)
+    
+    def stream(self, query: str, timeout: Optional[float] = None,
+               session_id: Optional[str] = None) -> Iterator[Tuple[str, Any]]:
+        """Processes query, yielding answer tokens and progress as graph nodes finish
+        
+        Yields ("token", {"agent", "text"}) for every generated token of a specialist answer (text None:
+        the attempt failed and the tokens so far are void), ("node", name) for every finished node,
+        ("answer", {"agent", "answer"}) for every specialist answer as soon as it is ready, and finally
+        ("result", ProcessResult). Closing the generator early stops the graph before its next step.
+        """
+        total_start_time = time.time()
+        state = self._initial_state(query, timeout, session_id)
+        request_id = state["request_id"]
+        events: queue.Queue = queue.Queue()
+        closed = threading.Event()
+        
+        def run():
+            # The graph runs on its own thread so tokens reach the consumer while a node is running
+            final_state = None
+            try:
+                steps = self.graph.stream(state, stream_mode=["updates", "values"])
+                for mode, data in steps:
+                    if mode == "values":
+                        final_state = data
+                        continue
+                    for node, update in data.items():
+                        events.put(("node", node))
+                        for answer in (update or {}).get("answers", []):
+                            events.put(("answer", answer))
+                    if closed.is_set():
+                        steps.close()
+                        return
+                events.put(("done", final_state))
+            except BaseException as error:
+                events.put(("error", error))
+            finally:
+                with self._stats_lock:
+                    self._token_sinks.pop(request_id, None)
+        
+        with self._stats_lock:
+            self._token_sinks[request_id] = lambda agent, text: events.put(("token", {"agent": agent, "text": text}))
+        threading.Thread(target=run, name="graph-stream", daemon=True).start()
+        try:
+            while True:
+                kind, data = events.get()
+                if kind == "done":
+                    break
+                if kind == "error":
+                    raise data
+                yield kind, data
+        finally:
+            closed.set()
+        
+        yield "result", self._finish(query, data, total_start_time)
+    
+    def session_memory(self, session_id: Optional[str]) -> SessionMemorySystem:
+        """Returns memory of a session (the default session for None)"""
+        if session_id is None:
+            return self.memory
+        with self._stats_lock:
+            memory = self.sessions.get(session_id)
+            if memory is None:
+                memory = self.sessions[session_id] = SessionMemorySystem()
+                if len(self.sessions) > WorkerConfig.MAX_SESSIONS:
+                    self.sessions.popitem(last=False)
+            else:
+                self.sessions.move_to_end(session_id)
+            return memory
+    
+    def _initial_state(self, query: str, timeout: Optional[float], session_id: Optional[str] = None) -> AgentState:
+        """Builds graph input state with the request deadline"""
+        if timeout is None:
+            timeout = DeadlineConfig.REQUEST_TIMEOUT
+        
         # Initialize state
-        initial_state: AgentState = {
-            "messages": [{"role": "user", "content": query}],
+        return {
             "current_agent": "",
             "agent_history": [],
             "tools_used": [],
             "query": query,
             "category": "",
+            "categories": [],
+            "answers": [],
             "final_answer": "",
-            "memory": {},
-            "execution_time": 0.0
+            "execution_time": 0.0,
+            "deadline": time.monotonic() + timeout,
+            "degraded_stages": [],
+            "session_id": session_id,
+            "request_id": uuid.uuid4().hex[:16],
+            "context": self.session_memory(session_id).get_context(2)
         }
-            
-        # Execute graph
-        result = self.graph.invoke(initial_state)
-        
-        # Save to memory
-        self.memory.add_interaction(
+    
+    def _finish(self, query: str, result: Dict[str, Any], total_start_time: float) -> ProcessResult:
+        """Saves the interaction and builds the result"""
+        # Save to session memory
+        memory = self.session_memory(result["session_id"])
+        memory.add_interaction(
             query=query,
             response=result["final_answer"],
             agent=result["current_agent"],
@@ -419,56 +824,73 @@ class MultiAgentSystem:
         
         total_execution_time = time.time() - total_start_time
         
-        # Format response
-        formatted_response = self._format_response(query, result, total_execution_time)
-        
-        return {
-            "query": query,
-            "category": result["category"],
-            "agent": result["current_agent"],
-            "agents_used": result["agent_history"],
-            "tools_used": result["tools_used"],
-            "response": result["final_answer"],
-            "agent_execution_time": result.get("execution_time", 0),
-            "total_execution_time": total_execution_time,
-            "formatted": formatted_response,
-            "memory_stats": self.memory.get_statistics()
-        }
+        # Formatting and statistics are deferred until the caller asks for them
+        return ProcessResult(self, query, result, total_execution_time, memory)
     
-    def _format_response(self, query: str, result: Dict, total_time: float) -> str:
+    def _format_response(self, result: ProcessResult) -> str:
         """Formats final response"""
-        current_time = datetime.now().strftime("%H:%M:%S")
+        current_time = datetime.fromtimestamp(result.finished_at).strftime("%H:%M:%S")
+        stats = result.memory_stats
         
         return f"""
 {'='*60}
 STUDYCODER ASSISTANT | {current_time}
 {'='*60}
 
-QUERY: {query}
+QUERY: {result.query}
 
-CATEGORY: {result['category']}
-AGENTS USED: {' → '.join(result['agent_history'])}
-TOOLS: {', '.join(result['tools_used']) if result['tools_used'] else 'not used'}
+CATEGORY: {', '.join(result.categories)}
+AGENTS USED: {' → '.join(result.agents_used)}
+TOOLS: {', '.join(result.tools_used) if result.tools_used else 'not used'}
+{f"DEGRADED (deadline): {', '.join(result.degraded_stages)}" if result.degraded_stages else ''}
 
 PROCESSING TIME:
-   • Agent: {result.get('execution_time', 0):.2f} sec
-   • Total: {total_time:.2f} sec
+   • Agent: {result.agent_execution_time:.2f} sec
+   • Total: {result.total_execution_time:.2f} sec
 
 {'='*60}
 
 ANSWER:
 
-{result['final_answer']}
+{result.response}
 
 {'='*60}
 
 SESSION STATISTICS:
-• Total interactions: {self.memory.user_profile['interaction_count']}
-• Topics discussed: {len(self.memory.user_profile['topics_discussed'])}
-• Unique agents: {', '.join(self.memory.get_statistics()['agents_used'])}
+• Total interactions: {stats['user_profile']['interaction_count']}
+• Topics discussed: {len(stats['user_profile']['topics_discussed'])}
+• Unique agents: {', '.join(stats['agents_used'])}
 {'='*60}
 """
     
+    def get_performance_stats(self) -> Dict[str, Any]:
+        """Returns live per-node latency and cache hit rates"""
+        nodes = {
+            node: {
+                "count": len(window),
+                "p50": window.percentile(50),
+                "p95": window.percentile(95)
+            }
+            for node, window in sorted(self.node_latency.items())
+        }
+        with self._stats_lock:
+            router_cache = dict(self.router_cache_stats)
+        lookups = router_cache["hits"] + router_cache["misses"]
+        router_cache["hit_rate"] = router_cache["hits"] / lookups if lookups else 0.0
+        return {
+            "nodes": nodes,
+            "coalescing": self.flight.get_statistics(),
+            "router_cache": router_cache,
+            "limiter": self.limiter.get_statistics()
+        }
+    
+    def get_resilience_stats(self) -> Dict[str, Any]:
+        """Returns concurrency limit, retry and hedge counters"""
+        return {
+            "limiter": self.limiter.get_statistics(),
+            "agents": {name: chain.get_statistics() for name, chain in self.resilient_agents.items()}
+        }
+    
     def get_system_info(self) -> Dict[str, Any]:
         """Returns system information"""
         return {
@@ -481,6 +903,15 @@ SESSION STATISTICS:
             "agents": ["router", "theory", "code", "planner", "general"],
             "tools": ["execute_python_code", "search_knowledge_base", "create_study_plan"],
             "memory_system": "SessionMemorySystem",
+            "sessions": len(self.sessions),
             "graph_engine": "LangGraph",
+            "coalescing": self.flight.get_statistics(),
+            "resilience": self.get_resilience_stats(),
+            "deadline_hits": dict(self.deadline_hits),
+            "prompt_cache": self.prompt_cache.get_statistics(),
+            "ledger": self.ledger.summary(),
+            "cassette": self.llm.get_statistics() if isinstance(self.llm, CassetteChatModel) else None,
+            "profiling": {"mode": self.profiler.mode, "rate": self.profiler.rate,
+                          "profiled_requests": self.profiler.profiled},
             "statistics": self.memory.get_statistics()
         }
\ No newline at end of file
@@ -0,0 +1,314 @@
+"""Benchmarks against the fake LLM backend
+
+Usage: python src/benchmark.py {router,coalesce,resilience,prefetch,fanout,result,prefix,workers,all}
+"""
+
+import argparse
+import os
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langgraph.graph.message import add_messages
+from config import RouterConfig, ResilienceConfig, ToolConfig
+from agents import MultiAgentSystem, ProcessResult
+from cassette import CassetteChatModel
+from prompts import PROMPT_REGISTRY
+from stand_in_server import StandInServer
+from workers import WorkerPool
+from tools import search_knowledge_base, create_study_plan
+
+LABELLED_QUERIES = [
+    ("What are multi-agent systems in LangChain context?", "theory"),
+    ("Write Python function to check if string is palindrome", "code"),
+    ("Help create Python and algorithms study plan for 2 weeks", "planning"),
+    ("Hello! Tell me about agents in your system and how they work?", "general"),
+    ("Explain difference between array and linked list", "theory"),
+    ("Write code to read CSV file and calculate column average", "code"),
+]
+
+
+def _summary(latencies: List[float]) -> str:
+    """Formats latency list"""
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"mean {statistics.mean(ordered) * 1000:7.1f} ms | p95 {p95 * 1000:7.1f} ms"
+
+
+def bench_router(system: MultiAgentSystem, rounds: int) -> None:
+    """Compares free-text and constrained router decoding"""
+    modes = [
+        ("free", "free", False),
+        ("constrained", "constrained", False),
+        ("constrained+guided", "constrained", True),
+    ]
+    print(f"\n ROUTER BENCHMARK ({rounds} rounds x {len(LABELLED_QUERIES)} queries)")
+    print("-" * 60)
+    for label, mode, guided in modes:
+        RouterConfig.MODE, RouterConfig.GUIDED_CHOICE = mode, guided
+        system.router_agent = system._wrap_agent("router", system._create_router_agent())
+
+        usage = UsageMetadataCallbackHandler()
+        latencies, correct = [], 0
+        for _ in range(rounds):
+            for query, expected in LABELLED_QUERIES:
+                start = time.perf_counter()
+                category = system.classify(query, {"callbacks": [usage]})
+                latencies.append(time.perf_counter() - start)
+                correct += category == expected
+
+        total = rounds * len(LABELLED_QUERIES)
+        output_tokens = sum(u["output_tokens"] for u in usage.usage_metadata.values())
+        print(f"• {label:<20} {_summary(latencies)} | "
+              f"output tokens/call {output_tokens / total:5.1f} | accuracy {correct / total:.0%}")
+    RouterConfig.MODE, RouterConfig.GUIDED_CHOICE = "constrained", False
+    system.router_agent = system._wrap_agent("router", system._create_router_agent())
+
+
+def bench_coalesce(system: MultiAgentSystem, rounds: int) -> None:
+    """Fires a burst of near-identical concurrent queries"""
+    students = 24
+    queries = ["Explain what is recursion?", "explain what is  recursion", "Explain what is recursion"]
+    print(f"\n COALESCING BENCHMARK ({rounds} bursts x {students} concurrent students)")
+    print("-" * 60)
+    before = system.flight.get_statistics()
+    latencies = []
+    with ThreadPoolExecutor(max_workers=students) as pool:
+        for burst in range(rounds):
+            # Shared context so that every burst starts from the same memory state
+            system.memory.interactions.clear()
+            start = time.perf_counter()
+            list(pool.map(system.process, [queries[i % len(queries)] for i in range(students)]))
+            latencies.append(time.perf_counter() - start)
+    after = system.flight.get_statistics()
+    calls = after["calls"] - before["calls"]
+    executions = after["executions"] - before["executions"]
+    print(f"• burst wall time: {_summary(latencies)}")
+    print(f"• agent calls: {calls} | LLM executions: {executions} | "
+          f"saved: {calls - executions} ({(calls - executions) / max(calls, 1):.0%})")
+
+
+def bench_resilience(system: MultiAgentSystem, rounds: int) -> None:
+    """Router calls against a flaky backend with a slow replica, with and without hedging"""
+    requests = 100 * rounds
+    print(f"\n RESILIENCE BENCHMARK ({requests} requests, 5% failures, 5% slow replica)")
+    print("-" * 60)
+    # Faults are injected into the backend; replayed calls would never reach it
+    backend = system.llm
+    if isinstance(backend, CassetteChatModel):
+        if backend.mode != "record":
+            print(f"• skipped: cassette {backend.mode} mode replays calls without the backend (use record mode)")
+            return
+        backend = backend.inner
+    backend.failure_rate, backend.slow_rate = 0.05, 0.05
+    for hedge in (False, True):
+        ResilienceConfig.HEDGE = hedge
+        system.router_agent = system._wrap_agent("router", system._create_router_agent())
+        chain = system.resilient_agents["router"]
+        system.limiter.limit = float(ResilienceConfig.LIMIT_INITIAL)
+        latencies, failures = [], 0
+
+        def call(i: int):
+            # Unique queries so that coalescing does not hide backend behaviour
+            start = time.perf_counter()
+            system.router_agent.invoke({"query": f"Explain topic number {i}"})
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for future in [pool.submit(call, i) for i in range(requests)]:
+                try:
+                    latencies.append(future.result())
+                except Exception:
+                    failures += 1
+        stats = chain.get_statistics()
+        print(f"• hedging {'on ' if hedge else 'off'}: {_summary(latencies)} | failed {failures} | "
+              f"retries {stats['retries']} | hedges {stats['hedges']} (won {stats['hedge_wins']}) | "
+              f"limit {system.limiter.get_statistics()['limit']}")
+    backend.failure_rate, backend.slow_rate = 0.0, 0.0
+    ResilienceConfig.HEDGE = False
+
+
+def bench_prefetch(system: MultiAgentSystem, rounds: int) -> None:
+    """Sequential vs concurrent tool execution in theory and planner nodes"""
+    queries = ["Explain what is an algorithm", "Create a study plan for 5 days on Python"]
+    tools = [search_knowledge_base, create_study_plan]
+    original = [tool.func for tool in tools]
+    print(f"\n TOOL PREFETCH BENCHMARK ({rounds} rounds x {len(queries)} queries)")
+    print("-" * 60)
+    for tool_latency in (0.0, 0.1):
+        # Simulated remote tool latency (e.g. a networked knowledge base)
+        for tool, func in zip(tools, original):
+            tool.func = (lambda f: lambda *a, **kw: (time.sleep(tool_latency), f(*a, **kw))[1])(func)
+        for prefetch in (False, True):
+            ToolConfig.PREFETCH = prefetch
+            latencies, grounded = [], 0
+            for _ in range(rounds):
+                for query in queries:
+                    result = system.process(query)
+                    latencies.append(result["total_execution_time"])
+                    grounded += "Grounded in" in result["response"]
+            total = rounds * len(queries)
+            print(f"• tool latency {tool_latency * 1000:3.0f} ms, {'prefetch  ' if prefetch else 'sequential'}: "
+                  f"{_summary(latencies)} | answers grounded in tool output {grounded / total:.0%}")
+    for tool, func in zip(tools, original):
+        tool.func = func
+    ToolConfig.PREFETCH = True
+
+
+def bench_fanout(system: MultiAgentSystem, rounds: int) -> None:
+    """Mixed-intent query: parallel specialist fan-out vs re-asking each part"""
+    query = "Explain quicksort and write it in Python, then plan a week to practice"
+    parts = ["Explain quicksort", "Write quicksort in Python", "Plan a week to practice quicksort"]
+    print(f"\n FAN-OUT BENCHMARK ({rounds} rounds)")
+    print("-" * 60)
+    RouterConfig.MULTI_INTENT = True
+    system.router_agent = system._wrap_agent("router", system._create_router_agent())
+    fanout, sequential, categories = [], [], []
+    for _ in range(rounds):
+        result = system.process(query)
+        fanout.append(result["total_execution_time"])
+        categories = result["categories"]
+        sequential.append(sum(system.process(part)["total_execution_time"] for part in parts))
+    print(f"• fan-out to {', '.join(categories)}: {_summary(fanout)}")
+    print(f"• re-asking {len(parts)} single-intent queries: {_summary(sequential)}")
+    RouterConfig.MULTI_INTENT = False
+    system.router_agent = system._wrap_agent("router", system._create_router_agent())
+
+
+def _former_eager_result(system: MultiAgentSystem, query: str, state: Dict, total_time: float) -> Dict:
+    """Result building before ProcessResult: banner and a second statistics pass, copied into a dict"""
+    result = ProcessResult(system, query, state, total_time)
+    formatted = system._format_response(result)  # The banner read session statistics itself
+    fields = {key: getattr(result, key) for key in ProcessResult.KEYS if key not in ("formatted", "memory_stats")}
+    return dict(fields, formatted=formatted, memory_stats=system.memory.get_statistics())
+
+
+def bench_result(system: MultiAgentSystem, rounds: int) -> None:
+    """Per-call overhead and allocations of building the process() result"""
+    calls = 2000 * rounds
+    # Fill session memory to its 20-interaction cap, as in a long session
+    for i in range(20):
+        last = system.process(f"What is topic {i}?")
+    state = {
+        "category": last.category, "categories": last.categories, "current_agent": last.agent,
+        "agent_history": last.agents_used, "tools_used": last.tools_used, "final_answer": last.response,
+        "execution_time": last.agent_execution_time, "degraded_stages": last.degraded_stages
+    }
+    print(f"\n RESULT OVERHEAD BENCHMARK ({calls} results)")
+    print("-" * 60)
+    builders = (
+        ("answer only (lazy)", lambda: ProcessResult(system, last.query, state, 0.0)),
+        ("formatted + memory_stats (lazy)", lambda: ProcessResult(system, last.query, state, 0.0).to_dict()),
+        ("former eager dict", lambda: _former_eager_result(system, last.query, state, 0.0)),
+        # Per-request work of the removed AgentState messages field (add_messages reducer on the input)
+        ("former AgentState messages field", lambda: add_messages([], [{"role": "user", "content": last.query}])),
+    )
+    for label, build in builders:
+        start = time.perf_counter()
+        for _ in range(calls):
+            build()
+        elapsed = time.perf_counter() - start
+        # Allocations of a single result (retained objects only: formatted text, stats)
+        tracemalloc.start()
+        result = build()
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        print(f"• {label:<40} {elapsed / calls * 1e6:7.1f} us/call | {retained / 1024:5.1f} KiB retained/call")
+
+
+def bench_prefix(system: MultiAgentSystem, rounds: int) -> None:
+    """Cached prompt tokens of the legacy prompt layout vs static system prefix (stand-in server)"""
+    server = StandInServer().start()
+    saved = {key: os.environ.get(key) for key in ("LLM_BACKEND", "LITELLM_BASE_URL", "PROMPT_VERSIONS")}
+    os.environ.update({"LLM_BACKEND": "litellm", "LITELLM_BASE_URL": server.url})
+    specialists = [name for name in PROMPT_REGISTRY if not name.startswith("router")]
+    print(f"\n PREFIX CACHE BENCHMARK ({rounds} rounds x {len(LABELLED_QUERIES)} queries, one session)")
+    print("-" * 60)
+    try:
+        for label, pinned in (("v1 context in system message", ",".join(f"{name}=1" for name in specialists)),
+                              ("v2 static system prefix", "")):
+            os.environ["PROMPT_VERSIONS"] = pinned
+            server.cache.clear()
+            # Fresh session: the history context changes on every turn
+            session = MultiAgentSystem()
+            latencies = []
+            for _ in range(rounds):
+                for query, _ in LABELLED_QUERIES:
+                    latencies.append(session.process(query)["total_execution_time"])
+            stats = session.prompt_cache.get_statistics()
+            agents = [stats["agents"][name] for name in specialists if name in stats["agents"]]
+            calls = sum(agent["calls"] for agent in agents)
+            cached = sum(agent["cached_tokens"] for agent in agents)
+            prompt = sum(agent["prompt_tokens"] for agent in agents)
+            print(f"• {label:<30} specialists {cached / calls:5.1f} of {prompt / calls:5.1f} prompt tokens/call "
+                  f"cached ({cached / prompt:4.0%}) | all agents {stats['cached_ratio']:4.0%} | {_summary(latencies)}")
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        server.stop()
+
+
+def bench_workers(system: MultiAgentSystem, rounds: int) -> None:
+    """Throughput of one vs several worker processes on CPU-bound work (fake LLM without latency)"""
+    saved = {key: os.environ.get(key) for key in ("FAKE_LLM_LATENCY", "FAKE_LLM_TOKEN_LATENCY")}
+    os.environ.update({"FAKE_LLM_LATENCY": "0", "FAKE_LLM_TOKEN_LATENCY": "0"})
+    requests = 100 * rounds
+    sizes = sorted({1, max(2, os.cpu_count() or 1)})
+    print(f"\n WORKER PROCESSES BENCHMARK ({requests} requests, 32 sessions, {os.cpu_count()} CPU cores)")
+    print("-" * 60)
+    baseline = None
+    try:
+        for size in sizes:
+            with WorkerPool(workers=size) as pool:
+                # Warm-up: first requests of a worker pay for lazy imports
+                for future in [pool.submit("Hello", session_id=f"warmup-{i}") for i in range(4 * size)]:
+                    future.result()
+                start = time.perf_counter()
+                futures = [pool.submit(LABELLED_QUERIES[i % len(LABELLED_QUERIES)][0], session_id=f"s{i % 32}")
+                           for i in range(requests)]
+                for future in futures:
+                    future.result()
+                throughput = requests / (time.perf_counter() - start)
+                baseline = baseline or throughput
+                stats = pool.get_statistics()
+            served = ", ".join(f"{worker_id}: {worker.get('served', 0)}" for worker_id, worker in stats["workers"].items())
+            print(f"• {size} worker(s): {throughput:6.1f} req/s (x{throughput / baseline:.2f}) | served {served}")
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+BENCHMARKS: Dict[str, callable] = {
+    "router": bench_router,
+    "coalesce": bench_coalesce,
+    "resilience": bench_resilience,
+    "prefetch": bench_prefetch,
+    "fanout": bench_fanout,
+    "result": bench_result,
+    "prefix": bench_prefix,
+    "workers": bench_workers,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StudyCoder Assistant benchmarks (fake LLM)")
+    parser.add_argument("scenario", choices=sorted(BENCHMARKS) + ["all"])
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    system = MultiAgentSystem()
+    for name, bench in BENCHMARKS.items():
+        if args.scenario in (name, "all"):
+            bench(system, args.rounds)
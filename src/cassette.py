@@ -0,0 +1,153 @@
+"""Record/replay cassette for LLM calls
+
+Wraps a chat model. In record mode every call is forwarded and stored as one JSON file named by
+the sha256 of its request (model, temperature, messages, call parameters). In replay mode
+responses are served from these files; a request that was never recorded raises CassetteMiss.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+MODES = ("record", "replay", "auto")
+
+# Prompt parts that change between otherwise identical runs (study plan dates and weekdays)
+VOLATILE_PATTERNS = [
+    (re.compile(r"\b\d{2}\.\d{2}\.\d{4}\b"), "<date>"),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}(T[\d:.]+)?\b"), "<date>"),
+    (re.compile(r"\b(Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)\b"), "<weekday>"),
+]
+
+
+class CassetteMiss(LookupError):
+    """Replay mode request that is not in the cassette"""
+
+
+def normalize_content(content: Any) -> str:
+    """Message content with volatile parts masked"""
+    text = content if isinstance(content, str) else json.dumps(content, sort_keys=True, ensure_ascii=False)
+    for pattern, replacement in VOLATILE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class CassetteChatModel(BaseChatModel):
+    """Chat model recording responses of an inner model or replaying them from disk"""
+
+    inner: BaseChatModel
+    mode: str = "replay"
+    directory: str = "cassettes"
+    # "recorded" replays the recorded latency, a number sleeps that many seconds, 0 answers at once
+    latency: str = "0"
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown cassette mode: {self.mode} (expected one of {', '.join(MODES)})")
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "recorded": 0}
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.inner, "model_name", None) or getattr(self.inner, "model", "")
+
+    @property
+    def temperature(self) -> Optional[float]:
+        return getattr(self.inner, "temperature", None)
+
+    def request_key(self, messages: List[BaseMessage], stop: Optional[List[str]], params: Dict[str, Any]) -> Dict[str, Any]:
+        """Content that identifies a call"""
+        return {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "messages": [{"type": m.type, "content": normalize_content(m.content)} for m in messages],
+            "stop": stop,
+            # The client timeout depends on the remaining deadline, not on the request
+            "params": {key: value for key, value in sorted(params.items()) if key != "timeout"}
+        }
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Cassettes hold whole answers: a streamed call records without streaming and emits the answer as one token
+        streamed = kwargs.pop("stream", False)
+        kwargs.pop("stream_usage", None)
+        request = self.request_key(messages, stop, kwargs)
+        key = hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+        path = self.path_for(key)
+
+        if self.mode != "record" and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            self._count("hits")
+            delay = entry["latency"] if self.latency == "recorded" else float(self.latency)
+            if delay:
+                time.sleep(delay)
+            response = entry["response"]
+            message = AIMessage(content=response["content"], usage_metadata=response.get("usage_metadata"),
+                                response_metadata=dict(response.get("response_metadata") or {}, cassette="hit"))
+            if streamed and run_manager:
+                run_manager.on_llm_new_token(message.text)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        if self.mode == "replay":
+            self._count("misses")
+            preview = request["messages"][-1]["content"][:80] if request["messages"] else ""
+            raise CassetteMiss(f"No cassette entry {key[:12]} in {self.directory} for {self.model_name} "
+                               f"(last message: {preview!r}); record it with LLM_CASSETTE_MODE=record")
+
+        start = time.perf_counter()
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        latency = time.perf_counter() - start
+        message = result.generations[0].message
+        self._save(path, {
+            "key": key,
+            "request": request,
+            "response": {
+                "content": message.content,
+                "usage_metadata": getattr(message, "usage_metadata", None),
+                "response_metadata": getattr(message, "response_metadata", None) or {}
+            },
+            "latency": round(latency, 4),
+            "recorded_at": time.time()
+        })
+        self._count("recorded")
+        if streamed and run_manager:
+            run_manager.on_llm_new_token(message.text)
+        return result
+
+    def _save(self, path: str, entry: Dict[str, Any]):
+        """Writes entry atomically (concurrent identical calls may record the same file)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=1, default=str)
+        os.replace(tmp, path)
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+    def get_statistics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({"mode": self.mode, "directory": self.directory})
+        return stats
@@ -11,14 +11,157 @@ class LLMConfig:
     
     @staticmethod
     def get_llm():
-        """Creates LLM with your settings"""
+        """Creates LLM with your settings, wrapped in a record/replay cassette if enabled"""
+        llm = LLMConfig._get_backend_llm()
+        mode = os.getenv("LLM_CASSETTE_MODE", "off")
+        if mode == "off":
+            return llm
+
+        from cassette import CassetteChatModel
+        llm = CassetteChatModel(
+            inner=llm,
+            mode=mode,
+            directory=os.getenv("LLM_CASSETTE_DIR", "cassettes"),
+            latency=os.getenv("LLM_CASSETTE_LATENCY", "0")
+        )
+        print(f" Cassette: {mode} ({llm.directory})")
+        return llm
+
+    @staticmethod
+    def _get_backend_llm():
+        """Creates LLM of the configured backend"""
+        if os.getenv("LLM_BACKEND", "litellm") == "fake":
+            from fake_llm import FakeChatModel
+            llm = FakeChatModel(
+                latency=float(os.getenv("FAKE_LLM_LATENCY", "0.05")),
+                token_latency=float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0.002")),
+                failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+                slow_rate=float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+            )
+            print(f"LLM created: {llm.model_name} (fake backend)")
+            return llm
+
         llm = ChatOpenAI(
             openai_api_base=os.getenv("LITELLM_BASE_URL", "http://your_base_url"),
             openai_api_key=os.getenv("LITELLM_API_KEY", "key"),
             model_name=os.getenv("MODEL_NAME", "qwen3-32b"),
-            temperature=0.3
+            temperature=0.3,
+            # Upper bound per call; ResilientChain lowers it to the remaining request deadline
+            request_timeout=ResilienceConfig.ATTEMPT_TIMEOUT,
+            max_retries=0  # Retries are handled by ResilientChain
         )
         print(f"LLM created: {llm.model_name}")
         print(f" Base URL: {llm.openai_api_base}")
         print(f" Temperature: {llm.temperature}")
-        return llm
\ No newline at end of file
+        return llm
+
+class RouterConfig:
+    """Router decoding settings"""
+
+    # "constrained" caps generation and parses the first valid label, "free" is the legacy mode
+    MODE = os.getenv("ROUTER_MODE", "constrained")
+    MAX_TOKENS = int(os.getenv("ROUTER_MAX_TOKENS", "8"))
+    # No newline here: qwen3 may open with an empty <think></think> block
+    STOP = [".", ","]
+    # Ask the backend for enum output (vLLM guided_choice via LiteLLM)
+    GUIDED_CHOICE = os.getenv("ROUTER_GUIDED_CHOICE", "0") == "1"
+    # Let the router return several comma-separated categories for mixed-intent queries
+    MULTI_INTENT = os.getenv("ROUTER_MULTI_INTENT", "0") == "1"
+    MULTI_INTENT_MAX_TOKENS = int(os.getenv("ROUTER_MULTI_INTENT_MAX_TOKENS", "16"))
+
+class CoalescingConfig:
+    """In-flight request coalescing settings"""
+
+    ENABLED = os.getenv("LLM_COALESCE", "1") == "1"
+    MAX_WORKERS = int(os.getenv("LLM_COALESCE_WORKERS", "32"))
+
+class ResilienceConfig:
+    """Client-side resilience settings for LLM calls"""
+
+    RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+    BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.2"))
+    BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "2.0"))
+    LIMIT_INITIAL = int(os.getenv("LLM_LIMIT_INITIAL", "8"))
+    LIMIT_MIN = int(os.getenv("LLM_LIMIT_MIN", "1"))
+    LIMIT_MAX = int(os.getenv("LLM_LIMIT_MAX", "64"))
+    # Latency above tolerance x recent median counts as overload
+    LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.0"))
+    HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+    HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    # Timeout cap of one LLM call attempt (sec); the request deadline lowers it further
+    ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30"))
+
+class DeadlineConfig:
+    """Per-request time budget settings (seconds)"""
+
+    REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+    # Below this budget the router skips the LLM and uses cached or keyword decisions
+    ROUTER_MIN_BUDGET = float(os.getenv("ROUTER_MIN_BUDGET", "1.0"))
+    # Share of the remaining budget the router LLM call may spend
+    ROUTER_BUDGET_SHARE = float(os.getenv("ROUTER_BUDGET_SHARE", "0.25"))
+    # Below this budget optional tool augmentation is skipped
+    TOOL_RESERVE = float(os.getenv("TOOL_RESERVE", "2.0"))
+    ROUTER_CACHE_SIZE = int(os.getenv("ROUTER_CACHE_SIZE", "1024"))
+
+class ToolConfig:
+    """Tool execution settings"""
+
+    # Start deterministic tools concurrently with the LLM call and feed their output into the prompt
+    PREFETCH = os.getenv("TOOL_PREFETCH", "1") == "1"
+    # How long the prompt waits for a prefetched tool before the LLM call starts without it (sec).
+    # Cassette runs wait until the tool finishes, so that prompts and cassette keys do not depend on timing
+    PREFETCH_WAIT = (None if os.getenv("LLM_CASSETTE_MODE", "off") != "off"
+                     else float(os.getenv("TOOL_PREFETCH_WAIT", "0.05")))
+    MAX_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+
+class ProfilingConfig:
+    """Per-request profiling settings"""
+
+    # "off", "sample" (stack sampling, collapsed stacks) or "cprofile" (pstats)
+    MODE = os.getenv("PROFILE_MODE", "off")
+    # Fraction of requests profiled automatically in MODE (0 profiles only explicit requests)
+    RATE = float(os.getenv("PROFILE_RATE", "0"))
+    DIR = os.getenv("PROFILE_DIR", "profiles")
+    # Number of most recent profiled requests whose files are kept
+    KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+    INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+class WorkerConfig:
+    """Multi-process worker mode settings"""
+
+    # Worker processes started by WorkerPool (0: one per CPU core)
+    WORKERS = int(os.getenv("WORKERS", "0"))
+    # Requests processed concurrently inside one worker
+    THREADS = int(os.getenv("WORKER_THREADS", "4"))
+    # Virtual nodes per worker on the consistent hash ring
+    RING_REPLICAS = int(os.getenv("WORKER_RING_REPLICAS", "64"))
+    # Start a replacement when a worker dies
+    RESPAWN = os.getenv("WORKER_RESPAWN", "1") == "1"
+    # Keep worker output (agent logs) on stdout
+    LOG = os.getenv("WORKER_LOG", "0") == "1"
+    # Session memories kept per process (least recently used are dropped)
+    MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+
+class EvaluationConfig:
+    """Evaluation runner settings"""
+
+    CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "8"))
+    # Checkpoints of evaluation runs
+    DIR = os.getenv("EVAL_DIR", "eval_runs")
+
+class LedgerConfig:
+    """Token and latency ledger settings"""
+
+    ENABLED = os.getenv("LEDGER", "1") == "1"
+    DIR = os.getenv("LEDGER_DIR", "ledger")
+    # Log file is rotated above this size; BACKUPS rotated files are kept
+    MAX_BYTES = int(os.getenv("LEDGER_MAX_BYTES", "5000000"))
+    BACKUPS = int(os.getenv("LEDGER_BACKUPS", "5"))
+    # Rows buffered before a batch is appended to the log
+    BATCH = int(os.getenv("LEDGER_BATCH", "100"))
+    # Prices per million tokens (0: cost is not tracked)
+    PRICES = {
+        "input": float(os.getenv("LEDGER_PRICE_INPUT", "0")),
+        "cached": float(os.getenv("LEDGER_PRICE_CACHED", "0")),
+        "output": float(os.getenv("LEDGER_PRICE_OUTPUT", "0"))
+    }
@@ -0,0 +1,267 @@
+"""Parallel, resumable routing and answer evaluation on a labelled JSONL dataset
+
+Dataset lines: {"id": "...", "query": "...", "expected": "theory"} ("expected" may list several
+categories of a mixed-intent query; "id" and "session_id" are optional).
+
+Usage: python src/evaluation.py data/eval_sample.jsonl [--mode router|full] [--concurrency 8]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+from config import EvaluationConfig, RouterConfig
+from prompts import active_versions
+from routing import VALID_CATEGORIES
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """Reads labelled items; items without an id get one from line number and query"""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            expected = item["expected"]
+            item["expected"] = [expected] if isinstance(expected, str) else list(expected)
+            if "id" not in item:
+                item["id"] = f"{line_no}-{hashlib.sha256(item['query'].encode()).hexdigest()[:12]}"
+            items.append(item)
+    return items
+
+
+def run_fingerprint(system) -> str:
+    """Identifies the model, router settings and prompt versions a record was produced with"""
+    settings = {
+        "model": getattr(system.llm, "model_name", "") or os.getenv("MODEL_NAME", "qwen3-32b"),
+        "router_mode": RouterConfig.MODE,
+        "multi_intent": RouterConfig.MULTI_INTENT,
+        "prompts": active_versions()
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_checkpoint(path: str, mode: str, fingerprint: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Returns completed records of a previous run with the same mode and fingerprint by item id"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Last line of an interrupted run may be incomplete
+            if record.get("mode") == mode and record.get("fingerprint") == fingerprint:
+                done[record["id"]] = record
+    return done
+
+
+class Evaluator:
+    """Runs dataset items with bounded concurrency, checkpointing every completed item"""
+
+    MODES = ("router", "full")
+
+    def __init__(self, system, mode: str = "router", concurrency: int = 8,
+                 checkpoint: Optional[str] = None, timeout: Optional[float] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown evaluation mode: {mode}")
+        self.system = system
+        self.mode = mode
+        self.concurrency = concurrency
+        self.checkpoint = checkpoint
+        self.timeout = timeout
+        # Records of another model, router setup or prompt version are not reused
+        self.fingerprint = run_fingerprint(system)
+        self._lock = threading.Lock()
+
+    def run(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Evaluates items not in the checkpoint yet and returns the report over all items"""
+        done = load_checkpoint(self.checkpoint, self.mode, self.fingerprint) if self.checkpoint else {}
+        todo = [item for item in items if item["id"] not in done]
+        print(f"\n Evaluating {len(todo)} items ({len(items) - len(todo)} from checkpoint), "
+              f"mode {self.mode}, concurrency {self.concurrency}, run {self.fingerprint}")
+
+        errors = {}
+        interrupted = False
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="eval")
+        try:
+            futures = {executor.submit(self._evaluate, item): item for item in todo}
+            for i, future in enumerate(as_completed(futures), 1):
+                item = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # Failed items are not checkpointed, so a rerun retries them
+                    errors[item["id"]] = f"{type(e).__name__}: {e}"
+                    continue
+                done[item["id"]] = record
+                self._save(record)
+                if i % 25 == 0:
+                    print(f"  {i}/{len(todo)} done")
+        except KeyboardInterrupt:
+            interrupted = True
+            print("\n Evaluation interrupted; completed items are kept in the checkpoint")
+        finally:
+            executor.shutdown(wait=not interrupted, cancel_futures=True)
+
+        records = [done[item["id"]] for item in items if item["id"] in done]
+        report = build_report(records)
+        report.update({
+            "mode": self.mode,
+            "fingerprint": self.fingerprint,
+            "items": len(items),
+            "errors": errors,
+            "interrupted": interrupted,
+            "wall_time": round(time.perf_counter() - start, 3)
+        })
+        return report
+
+    def _evaluate(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Runs one item and returns its record"""
+        start = time.perf_counter()
+        record = {"id": item["id"], "mode": self.mode, "fingerprint": self.fingerprint,
+                  "query": item["query"], "expected": item["expected"]}
+        if self.mode == "router":
+            predicted = self.system.classify_all(item["query"], timeout=self.timeout)
+        else:
+            # Separate session per item unless the dataset groups items into sessions
+            result = self.system.process(item["query"], timeout=self.timeout,
+                                         session_id=item.get("session_id", f"eval-{item['id']}"))
+            predicted = result.categories
+            record.update({"agents": result.agents_used, "tools": result.tools_used,
+                           "degraded": result.degraded, "answer_chars": len(result.response)})
+        record["predicted"] = predicted
+        record["latency"] = round(time.perf_counter() - start, 4)
+        return record
+
+    def _save(self, record: Dict[str, Any]):
+        """Appends record to the checkpoint"""
+        if not self.checkpoint:
+            return
+        with self._lock:
+            with open(self.checkpoint, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Returns latency distribution (seconds)"""
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    return {
+        "mean": round(statistics.mean(ordered), 4),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1]
+    }
+
+
+def build_report(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Accuracy, confusion matrix and latency distribution per expected category"""
+    confusion = {expected: {predicted: 0 for predicted in VALID_CATEGORIES} for expected in VALID_CATEGORIES}
+    per_category: Dict[str, Dict[str, Any]] = {}
+    latencies: Dict[str, List[float]] = {}
+    correct = exact = 0
+    for record in records:
+        expected, predicted = record["expected"][0], (record["predicted"] or ["general"])[0]
+        confusion.setdefault(expected, {}).setdefault(predicted, 0)
+        confusion[expected][predicted] += 1
+        correct += expected == predicted
+        # Mixed-intent items also need the full, ordered category list
+        exact += record["expected"] == record["predicted"]
+        latencies.setdefault(expected, []).append(record["latency"])
+
+    for category, row in confusion.items():
+        support = sum(row.values())
+        predicted_total = sum(confusion[other].get(category, 0) for other in confusion)
+        if not support and not predicted_total:
+            continue
+        per_category[category] = {
+            "support": support,
+            "recall": row.get(category, 0) / support if support else 0.0,
+            "precision": row.get(category, 0) / predicted_total if predicted_total else 0.0,
+            "latency": _latency_summary(latencies.get(category, []))
+        }
+
+    return {
+        "evaluated": len(records),
+        "accuracy": correct / len(records) if records else 0.0,
+        "exact_match": exact / len(records) if records else 0.0,
+        "per_category": per_category,
+        "confusion": confusion,
+        "latency": _latency_summary([record["latency"] for record in records])
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Formats report as text"""
+    lines = [
+        "\n EVALUATION REPORT",
+        "=" * 60,
+        f"• Mode: {report['mode']} | evaluated {report['evaluated']}/{report['items']} "
+        f"| errors {len(report['errors'])}{' | interrupted' if report['interrupted'] else ''}",
+        f"• Accuracy (primary category): {report['accuracy']:.1%}",
+        f"• Exact match (all categories, in order): {report['exact_match']:.1%}",
+    ]
+    latency = report["latency"]
+    if latency:
+        lines.append(f"• Latency: p50 {latency['p50']:.3f} sec | p95 {latency['p95']:.3f} sec | "
+                     f"max {latency['max']:.3f} sec | wall time {report['wall_time']:.2f} sec")
+
+    lines.append("\n Per category:")
+    for category, stats in report["per_category"].items():
+        latency = stats["latency"]
+        lines.append(f"• {category:<9} support {stats['support']:3d} | recall {stats['recall']:6.1%} | "
+                     f"precision {stats['precision']:6.1%}"
+                     + (f" | p50 {latency['p50']:.3f} sec | p95 {latency['p95']:.3f} sec" if latency else ""))
+
+    labels = list(report["confusion"])
+    lines.append("\n Confusion matrix (rows: expected, columns: predicted):")
+    lines.append(" " * 11 + "".join(f"{label[:9]:>10}" for label in labels))
+    for expected in labels:
+        row = report["confusion"][expected]
+        lines.append(f" {expected[:9]:<10}" + "".join(f"{row.get(label, 0):>10}" for label in labels))
+
+    for item_id, error in list(report["errors"].items())[:5]:
+        lines.append(f" Error {item_id}: {error}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StudyCoder Assistant routing / answer evaluation")
+    parser.add_argument("dataset", help="Labelled JSONL dataset")
+    parser.add_argument("--mode", choices=Evaluator.MODES, default="router")
+    parser.add_argument("--concurrency", type=int, default=EvaluationConfig.CONCURRENCY)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: EVAL_DIR/<dataset>.<mode>.jsonl)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore and replace an existing checkpoint")
+    parser.add_argument("--limit", type=int, help="Evaluate only the first N items")
+    parser.add_argument("--timeout", type=float, help="Per-item time budget (sec)")
+    parser.add_argument("--report", help="Write JSON report to this file")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint
+    if not checkpoint:
+        os.makedirs(EvaluationConfig.DIR, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(args.dataset))[0]
+        checkpoint = os.path.join(EvaluationConfig.DIR, f"{stem}.{args.mode}.jsonl")
+    if args.fresh and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    items = load_dataset(args.dataset)[:args.limit]
+
+    from agents import MultiAgentSystem
+    evaluator = Evaluator(MultiAgentSystem(), args.mode, args.concurrency, checkpoint, args.timeout)
+    report = evaluator.run(items)
+    print(format_report(report))
+    print(f"\n Checkpoint: {checkpoint}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
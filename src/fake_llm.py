@@ -0,0 +1,149 @@
+"""Fake chat model for offline runs and benchmarks"""
+
+import random
+import re
+import time
+from typing import Any, Iterator, List, Optional, Tuple
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from routing import MAX_INTENTS, VALID_CATEGORIES, classify_by_keywords, match_categories
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic stand-in for the LiteLLM server with simulated latency"""
+
+    model_name: str = "fake-qwen3"
+    temperature: float = 0.3
+    latency: float = 0.05  # Time to first token (sec)
+    token_latency: float = 0.002  # Time per generated token (sec)
+    reasoning: bool = True  # Emit <think> blocks like qwen3 unless /no_think is set
+    failure_rate: float = 0.0  # Share of calls failing with a transient connection error
+    slow_rate: float = 0.0  # Share of calls hitting a slow replica
+    slow_factor: float = 10.0  # Latency multiplier of the slow replica
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text, tokens, delay = self._reply(messages, stop, run_manager, kwargs)
+        # Client timeout the way the openai client applies it
+        timeout = kwargs.get("timeout")
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Simulated request timed out after {timeout:.2f} sec")
+        time.sleep(delay)
+        message = AIMessage(
+            content=text,
+            usage_metadata=self._usage(messages, tokens),
+            response_metadata={"model_name": self.model_name},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        text, tokens, delay = self._reply(messages, stop, run_manager, kwargs)
+        timeout = kwargs.get("timeout")
+        deadline = time.time() + timeout if timeout is not None else None
+        # Spread the delay over the first token and the rest, cutting off at the client timeout
+        scale = delay / (self.latency + self.token_latency * len(tokens))
+        for index, token in enumerate(tokens):
+            pause = scale * (self.token_latency + (self.latency if index == 0 else 0))
+            if deadline is not None and time.time() + pause > deadline:
+                time.sleep(max(deadline - time.time(), 0))
+                raise TimeoutError(f"Simulated request timed out after {timeout:.2f} sec")
+            time.sleep(pause)
+            last = index == len(tokens) - 1
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=token if index == 0 else " " + token,
+                usage_metadata=self._usage(messages, tokens) if last else None,
+                response_metadata={"model_name": self.model_name} if last else {},
+            ))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _reply(self, messages: List[BaseMessage], stop: Optional[List[str]], run_manager: Any,
+               kwargs: dict) -> Tuple[str, List[str], float]:
+        """Produces the reply text, its tokens and the simulated generation time"""
+        if random.random() < self.failure_rate:
+            time.sleep(self.latency)
+            raise ConnectionError("Simulated transient backend failure")
+
+        system_text = "\n".join(str(m.content) for m in messages if m.type == "system")
+        human_text = "\n".join(str(m.content) for m in messages if m.type == "human")
+
+        # Agents tag their LLM with run metadata; callers without a run manager pass agent= directly
+        agent = kwargs.get("agent") or (getattr(run_manager, "metadata", None) or {}).get("agent", "")
+        if agent == "router":
+            text = self._route(system_text, human_text, kwargs.get("extra_body") or {})
+        else:
+            text = self._answer(system_text, human_text, agent)
+
+        # Apply stop sequences and token limit the way a server would
+        for sequence in stop or []:
+            if sequence and sequence in text:
+                text = text[:text.index(sequence)]
+        tokens = text.split(" ")
+        max_tokens = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens")
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+            text = " ".join(tokens)
+
+        delay = self.latency + self.token_latency * len(tokens)
+        if random.random() < self.slow_rate:
+            delay *= self.slow_factor
+        return text, tokens, delay
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], tokens: List[str]) -> dict:
+        """Reports token usage the way the server does"""
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+
+    def _route(self, system_text: str, query: str, extra_body: dict) -> str:
+        """Produces router output"""
+        label = classify_by_keywords(query)
+        if "comma" in system_text and len(match_categories(query)) > 1:
+            label = ",".join(match_categories(query)[:MAX_INTENTS])
+        if extra_body.get("guided_choice"):
+            return label if label in extra_body["guided_choice"] else extra_body["guided_choice"][0]
+        if not self.reasoning or "/no_think" in system_text or "/no_think" in query:
+            return label
+        others = ", ".join(c for c in VALID_CATEGORIES if c != label)
+        return (
+            f"<think>\nThe user wrote: {query[:60]}. Let me consider each category: {others} "
+            f"do not seem to fit as well. The best match is {label}.\n</think>\n\n"
+            f"Category: {label.capitalize()}."
+        )
+
+    def _answer(self, system_text: str, human_text: str, agent: str = "") -> str:
+        """Produces specialist output"""
+        # Prompts with a static system prefix put context and facts before the question
+        question = re.search(r"^(?:Question|Request): (.*)", human_text, re.MULTILINE | re.DOTALL)
+        query = question.group(1) if question else human_text
+        answer = f"Here is a detailed answer to: {query[:80]}. " + "Explanation sentence. " * 20
+        # Tool output in the prompt shows up as bullet lines
+        facts = sum(1 for line in (system_text + "\n" + human_text).splitlines()
+                    if line.strip().startswith(("•", "Day ")))
+        if facts:
+            answer += f"Grounded in {facts} reference facts. "
+        if agent == "code":
+            answer += "\n\n```python\ndef solution(x):\n    return x\n\nresult = solution(42)\n```\n"
+        return answer.strip()
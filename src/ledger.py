@@ -0,0 +1,290 @@
+"""Per-call token and latency ledger for capacity planning
+
+Every LLM call of an agent becomes one row (request, session, category, node, model, tokens,
+latency, status, cassette). cassette is "hit" for calls replayed from a cassette, which report recorded
+tokens without backend latency; they are left out of latency and throughput figures. Rows are kept in memory for live aggregation and appended in batches to a
+rotating CSV log that can be aggregated offline: python src/ledger.py [LEDGER_DIR]
+"""
+
+import atexit
+import csv
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+
+COLUMNS = ("timestamp", "request_id", "session_id", "category", "node", "model", "prompt_tokens",
+           "cached_tokens", "completion_tokens", "latency", "status", "cassette")
+INT_COLUMNS = ("prompt_tokens", "cached_tokens", "completion_tokens")
+LOG_NAME = "ledger.csv"
+
+
+def call_cost(row: Dict[str, Any], prices: Dict[str, float]) -> float:
+    """Cost of one call; prices are per million input / cached input / output tokens"""
+    uncached = row["prompt_tokens"] - row["cached_tokens"]
+    return (uncached * prices.get("input", 0.0) + row["cached_tokens"] * prices.get("cached", 0.0)
+            + row["completion_tokens"] * prices.get("output", 0.0)) / 1e6
+
+
+def _fill_categories(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Attributes calls made before routing (router) to the category of their request"""
+    categories = {}
+    for row in rows:
+        if row["category"] and row["request_id"] not in categories:
+            categories[row["request_id"]] = row["category"]
+    return [row if row["category"] else dict(row, category=categories.get(row["request_id"], "unrouted"))
+            for row in rows]
+
+
+def aggregate(rows: Iterable[Dict[str, Any]], by: str = "category",
+              prices: Optional[Dict[str, float]] = None) -> Dict[str, Dict[str, Any]]:
+    """Totals per value of a column: calls, requests, tokens, latency, tokens/sec and cost
+
+    latency and completion tokens/sec cover backend calls only (cassette hits are counted in cassette_hits).
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    requests: Dict[str, set] = {}
+    backend_tokens: Dict[str, int] = {}
+    for row in _fill_categories(list(rows)):
+        group = groups.setdefault(row[by], {"calls": 0, "errors": 0, "cassette_hits": 0, "prompt_tokens": 0,
+                                            "cached_tokens": 0, "completion_tokens": 0, "latency": 0.0,
+                                            "cost": 0.0})
+        group["calls"] += 1
+        group["errors"] += row["status"] != "ok"
+        for column in INT_COLUMNS:
+            group[column] += row[column]
+        if row.get("cassette") == "hit":
+            group["cassette_hits"] += 1
+        else:
+            group["latency"] += row["latency"]
+            backend_tokens[row[by]] = backend_tokens.get(row[by], 0) + row["completion_tokens"]
+        group["cost"] += call_cost(row, prices or {})
+        requests.setdefault(row[by], set()).add(row["request_id"])
+
+    for key, group in groups.items():
+        group["requests"] = len(requests[key])
+        tokens = group["prompt_tokens"] + group["completion_tokens"]
+        group["tokens_per_request"] = tokens / group["requests"]
+        group["cost_per_request"] = group["cost"] / group["requests"]
+        # Generation speed while this group's calls were running
+        completion_tokens = backend_tokens.get(key, 0)
+        group["completion_tokens_per_sec"] = completion_tokens / group["latency"] if group["latency"] else 0.0
+        group["latency"] = round(group["latency"], 4)
+    return groups
+
+
+def top_sessions(rows: Iterable[Dict[str, Any]], n: int = 5,
+                 prices: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """Most expensive sessions (by cost, then by tokens)"""
+    sessions = aggregate(rows, by="session_id", prices=prices)
+    ranked = sorted(sessions.items(), reverse=True,
+                    key=lambda item: (item[1]["cost"], item[1]["prompt_tokens"] + item[1]["completion_tokens"]))
+    return [dict(stats, session_id=session_id) for session_id, stats in ranked[:n]]
+
+
+def load_rows(directory: str) -> List[Dict[str, Any]]:
+    """Reads rows of the current and rotated log files, oldest first"""
+    names = [name for name in os.listdir(directory) if name.startswith("ledger") and name.endswith(".csv")]
+    # ledger.N.csv is older than ledger.(N-1).csv; ledger.csv is the newest
+    names.sort(key=lambda name: -int(name.split(".")[1]) if name.count(".") == 2 else 0)
+    rows = []
+    for name in names:
+        with open(os.path.join(directory, name), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                for column in INT_COLUMNS:
+                    row[column] = int(row[column])
+                row["timestamp"] = float(row["timestamp"])
+                row["latency"] = float(row["latency"])
+                row["cassette"] = row.get("cassette") or ""  # Logs written before the column existed
+                rows.append(row)
+    return rows
+
+
+class TokenLedger:
+    """Records LLM calls, writes them to a rotating CSV log and aggregates them"""
+
+    def __init__(self, directory: str = "ledger", max_bytes: int = 5_000_000, backups: int = 5,
+                 batch_size: int = 100, prices: Optional[Dict[str, float]] = None, keep: int = 10000,
+                 enabled: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.prices = prices or {}
+        self.enabled = enabled
+        # Recent rows for live aggregation
+        self.rows: deque = deque(maxlen=keep)
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.started = time.time()
+        if enabled:
+            atexit.register(self.flush)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, LOG_NAME)
+
+    def handler(self, node: str) -> "LedgerHandler":
+        """Returns callback handler recording the calls of a node's agent"""
+        return LedgerHandler(node, self)
+
+    def record(self, row: Dict[str, Any]):
+        """Adds call row; full batches are written to the log"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.rows.append(row)
+            self._buffer.append(row)
+            if len(self._buffer) < self.batch_size:
+                return
+            batch, self._buffer = self._buffer, []
+        self._write(batch)
+
+    def flush(self):
+        """Writes buffered rows to the log"""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            # A log with other columns is rotated rather than appended to
+            if os.path.exists(self.path) and (os.path.getsize(self.path) >= self.max_bytes
+                                              or self._header() != list(COLUMNS)):
+                self._rotate()
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(batch)
+
+    def _header(self) -> List[str]:
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return next(csv.reader(f), [])
+
+    def _rotate(self):
+        """ledger.csv -> ledger.1.csv -> ... -> ledger.<backups>.csv (dropped)"""
+        for i in range(self.backups - 1, 0, -1):
+            older = os.path.join(self.directory, f"ledger.{i}.csv")
+            if os.path.exists(older):
+                os.replace(older, os.path.join(self.directory, f"ledger.{i + 1}.csv"))
+        if self.backups:
+            os.replace(self.path, os.path.join(self.directory, "ledger.1.csv"))
+        else:
+            os.remove(self.path)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.rows)
+
+    def aggregate(self, by: str = "category") -> Dict[str, Dict[str, Any]]:
+        """Aggregates recent calls by a column (category, node, session_id, model, ...)"""
+        return aggregate(self.snapshot(), by, self.prices)
+
+    def top_sessions(self, n: int = 5) -> List[Dict[str, Any]]:
+        return top_sessions(self.snapshot(), n, self.prices)
+
+    def tokens_per_second(self) -> float:
+        """Backend token throughput (prompt + completion) over the recorded period"""
+        rows = self.snapshot()
+        if not rows:
+            return 0.0
+        elapsed = max(time.time() - rows[0]["timestamp"], 1e-9)
+        return sum(row["prompt_tokens"] + row["completion_tokens"]
+                   for row in rows if row["cassette"] != "hit") / elapsed
+
+    def summary(self) -> Dict[str, Any]:
+        """Compact summary for get_system_info()"""
+        rows = self.snapshot()
+        by_category = aggregate(rows, "category", self.prices)
+        return {
+            "enabled": self.enabled,
+            "calls": len(rows),
+            "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+            "completion_tokens": sum(row["completion_tokens"] for row in rows),
+            "cost": round(sum(call_cost(row, self.prices) for row in rows), 6),
+            "tokens_per_sec": round(self.tokens_per_second(), 2),
+            "by_category": {
+                category: {key: round(stats[key], 6) for key in
+                           ("requests", "tokens_per_request", "cost_per_request", "completion_tokens_per_sec")}
+                for category, stats in by_category.items()
+            },
+            "top_sessions": [{"session_id": s["session_id"], "cost": round(s["cost"], 6),
+                              "tokens": s["prompt_tokens"] + s["completion_tokens"]}
+                             for s in top_sessions(rows, 3, self.prices)],
+            "log": self.path
+        }
+
+
+class LedgerHandler(BaseCallbackHandler):
+    """Times an agent's LLM calls and records their usage metadata"""
+
+    def __init__(self, node: str, ledger: TokenLedger):
+        self.node = node
+        self.ledger = ledger
+        self._started: Dict[Any, tuple] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs: Any) -> None:
+        self._started[run_id] = (time.perf_counter(), metadata or {})
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        start, metadata = self._started.pop(run_id, (None, {}))
+        usage, model, cassette = {}, "", ""
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or usage
+                response_metadata = getattr(message, "response_metadata", None) or {}
+                model = response_metadata.get("model_name", model)
+                cassette = response_metadata.get("cassette", cassette)
+        self._record(start, metadata, "ok", usage, model or (response.llm_output or {}).get("model_name", ""),
+                     cassette)
+
+    def on_llm_error(self, error, *, run_id, **kwargs: Any) -> None:
+        start, metadata = self._started.pop(run_id, (None, {}))
+        self._record(start, metadata, type(error).__name__, {}, "")
+
+    def _record(self, start: Optional[float], metadata: Dict[str, Any], status: str,
+                usage: Dict[str, Any], model: str, cassette: str = ""):
+        self.ledger.record({
+            "timestamp": time.time(),
+            "request_id": metadata.get("request_id", ""),
+            "session_id": metadata.get("session_id", ""),
+            "category": metadata.get("category", ""),
+            "node": self.node,
+            "model": model,
+            "prompt_tokens": usage.get("input_tokens", 0),
+            "cached_tokens": (usage.get("input_token_details") or {}).get("cache_read", 0) or 0,
+            "completion_tokens": usage.get("output_tokens", 0),
+            "latency": round(time.perf_counter() - start, 4) if start is not None else 0.0,
+            "status": status,
+            "cassette": cassette
+        })
+
+
+if __name__ == "__main__":
+    from config import LedgerConfig
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else LedgerConfig.DIR
+    rows = load_rows(directory)
+    print(f"\n TOKEN LEDGER: {len(rows)} calls in {directory}")
+    print("=" * 60)
+    for by in ("category", "node"):
+        print(f"\n By {by}:")
+        for key, stats in sorted(aggregate(rows, by, LedgerConfig.PRICES).items()):
+            print(f"• {key:<10} requests {stats['requests']:5d} | calls {stats['calls']:5d} | "
+                  f"{stats['tokens_per_request']:7.1f} tokens/request | "
+                  f"{stats['completion_tokens_per_sec']:7.1f} completion tokens/sec | "
+                  f"cassette hits {stats['cassette_hits']:5d} | "
+                  f"cost/request {stats['cost_per_request']:.6f}")
+    print("\n Top sessions:")
+    for session in top_sessions(rows, 5, LedgerConfig.PRICES):
+        print(f"• {session['session_id'] or 'default':<20} cost {session['cost']:.6f} | "
+              f"{session['prompt_tokens'] + session['completion_tokens']} tokens | {session['requests']} requests")
@@ -49,17 +49,27 @@ class SessionMemorySystem:
         
         return context
     
-    def get_statistics(self) -> Dict[str, Any]:
-        """Returns session statistics"""
-        agents_used = list(set([i["agent"] for i in self.interactions]))
-        categories_used = list(set([i["category"] for i in self.interactions]))
+    def checkpoint(self) -> tuple:
+        """Cheap marker of the current session state for get_statistics"""
+        return tuple(self.interactions), self.user_profile["interaction_count"], len(self.user_profile["topics_discussed"])
+    
+    def get_statistics(self, checkpoint: tuple = None) -> Dict[str, Any]:
+        """Returns session statistics, as of a checkpoint if one is given"""
+        if checkpoint is None:
+            checkpoint = self.checkpoint()
+        interactions, interaction_count, topics = checkpoint
+        agents_used = list(set([i["agent"] for i in interactions]))
+        categories_used = list(set([i["category"] for i in interactions]))
         all_tools = []
-        for i in self.interactions:
+        for i in interactions:
             all_tools.extend(i["tools_used"])
         
+        # Topics are only appended, so a prefix is the list as of the checkpoint
+        user_profile = dict(self.user_profile, interaction_count=interaction_count,
+                            topics_discussed=self.user_profile["topics_discussed"][:topics])
         return {
-            "total_interactions": len(self.interactions),
-            "user_profile": self.user_profile,
+            "total_interactions": len(interactions),
+            "user_profile": user_profile,
             "agents_used": agents_used,
             "categories_used": categories_used,
             "unique_tools_used": list(set(all_tools))
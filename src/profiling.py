@@ -0,0 +1,268 @@
+"""Opt-in per-request profiling with flamegraph-ready output"""
+
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Functions that identify where a sample or call belongs
+NODE_FUNCTIONS = {"router_node", "theory_node", "code_node", "planner_node", "general_node", "join_node"}
+TOOL_FUNCTIONS = {"execute_python_code", "search_knowledge_base", "create_study_plan"}
+LLM_PATHS = ("langchain_openai", os.sep + "openai" + os.sep, "httpx", "httpcore", "fake_llm.py")
+WAIT_PATHS = ("threading.py", os.path.join("concurrent", "futures"), "queue.py")
+
+Frame = Tuple[str, str, str]  # (filename, function, label)
+
+# Profiled request the current context works for, and the threads currently working for each one
+_request: contextvars.ContextVar = contextvars.ContextVar("profiled_request", default=None)
+_threads: Dict[int, str] = {}
+
+
+@contextmanager
+def attributed(tag: Optional[str] = None):
+    """Marks the current thread as working for a profiled request (default: the request of this context)"""
+    tag = tag or _request.get()
+    if tag is None:
+        yield
+        return
+    ident = threading.get_ident()
+    previous = _threads.get(ident)
+    token = _request.set(tag)
+    _threads[ident] = tag
+    try:
+        yield
+    finally:
+        _request.reset(token)
+        if previous is None:
+            _threads.pop(ident, None)
+        else:
+            _threads[ident] = previous
+
+
+def propagate(fn: Callable) -> Callable:
+    """Wraps fn submitted to a pool thread to work for the profiled request of the submitting context"""
+    tag = _request.get()
+    if tag is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with attributed(tag):
+            return fn(*args, **kwargs)
+    return run
+
+
+def attributed_node(fn: Callable) -> Callable:
+    """Graph node wrapper; LangGraph copies the context into the threads running parallel nodes"""
+    @functools.wraps(fn)
+    def node(*args, **kwargs):
+        if _request.get() is None:
+            return fn(*args, **kwargs)
+        with attributed():
+            return fn(*args, **kwargs)
+    return node
+
+
+def _frame_label(frame) -> str:
+    """Formats frame as module:function, tagging agent wrappers with their agent name"""
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    label = f"{module}:{code.co_name}"
+    if module in ("resilience", "singleflight") and code.co_name in ("invoke", "invoke_until", "_call"):
+        agent = getattr(frame.f_locals.get("self"), "name", None)
+        if agent:
+            label += f"[{agent}]"
+    return label
+
+
+def _walk(frame) -> List[Frame]:
+    """Returns stack from root to leaf"""
+    stack = []
+    while frame is not None:
+        stack.append((frame.f_code.co_filename, frame.f_code.co_name, _frame_label(frame)))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def classify_stack(stack: List[Frame]) -> Tuple[str, str]:
+    """Attributes a sampled stack to (stage, kind)"""
+    stage = "other"
+    for filename, function, label in stack:
+        if function in NODE_FUNCTIONS:
+            stage = function[:-len("_node")]
+        elif "[" in label:
+            stage = label[label.index("[") + 1:-1]
+
+    for filename, function, label in reversed(stack):
+        if function in TOOL_FUNCTIONS:
+            return stage, f"tool:{function}"
+        if os.path.join("langchain_core", "prompts") in filename:
+            return stage, "prompt"
+        if any(path in filename for path in LLM_PATHS):
+            return stage, "llm"
+
+    leaf = stack[-1][0]
+    if any(path in leaf for path in WAIT_PATHS):
+        return stage, "wait"
+    if "langgraph" in leaf or os.path.join("langchain_core", "runnables") in leaf:
+        return stage, "langgraph"
+    return stage, "app"
+
+
+class StackSampler(threading.Thread):
+    """Samples stacks of the threads working for one profiled request at a fixed interval"""
+
+    def __init__(self, interval: float, tag: str):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval = interval
+        self.tag = tag
+        self.stacks: Counter = Counter()
+        self.attribution: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            tagged = {ident for ident, tag in _threads.copy().items() if tag == self.tag}
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples = []
+            for ident in tagged:
+                if ident in frames:
+                    stack = _walk(frames[ident])
+                    samples.append((names.get(ident, str(ident)), stack, classify_stack(stack)))
+            # A thread waiting for another thread of the request (coalesced call, hedge, tool) is not
+            # counted on top of the work; a request that only waits counts one sample
+            working = [sample for sample in samples if sample[2][1] != "wait"]
+            for name, stack, attribution in working or samples[:1]:
+                thread = re.sub(r"_\d+$", "", name)
+                self.stacks[";".join([thread] + [label for _, _, label in stack])] += 1
+                self.attribution[attribution] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfiler:
+    """Profiles single requests or a sampled fraction of traffic"""
+
+    MODES = ("sample", "cprofile")
+
+    def __init__(self, mode: str = "off", rate: float = 0.0, output_dir: str = "profiles",
+                 keep: int = 20, interval: float = 0.005):
+        self.mode = mode
+        self.rate = rate
+        self.output_dir = output_dir
+        self.keep = keep
+        self.interval = interval
+        self.profiled = 0
+        self._lock = threading.Lock()
+
+    def choose_mode(self, requested: Optional[str]) -> Optional[str]:
+        """Returns profiling mode for a request, or None to run it unprofiled (always for requested=False)"""
+        if requested is False:
+            return None
+        if requested:
+            return requested if requested in self.MODES else (self.mode if self.mode in self.MODES else "sample")
+        if self.rate and self.mode in self.MODES and random.random() < self.rate:
+            return self.mode
+        return None
+
+    def run(self, mode: str, label: str, fn: Callable[[], Any]) -> Tuple[Any, Dict[str, Any]]:
+        """Runs fn under the profiler and writes its output files"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = re.sub(r"[^a-z0-9]+", "-", label.lower())[:40].strip("-") or "request"
+        with self._lock:
+            number = self.profiled
+            self.profiled += 1
+        tag = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{number}-{slug}"
+        base = os.path.join(self.output_dir, tag)
+
+        start = time.perf_counter()
+        if mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                result = fn()
+            finally:
+                profile.disable()
+            duration = time.perf_counter() - start
+            summary = self._write_cprofile(profile, base, duration)
+        else:
+            sampler = StackSampler(self.interval, tag)
+            sampler.start()
+            try:
+                with attributed(tag):
+                    result = fn()
+            finally:
+                sampler.stop()
+            duration = time.perf_counter() - start
+            summary = self._write_samples(sampler, base, duration)
+
+        summary.update({"label": label, "mode": mode, "duration": round(duration, 4)})
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        summary["files"].append(base + ".json")
+        self._apply_retention()
+        return result, summary
+
+    def _write_samples(self, sampler: StackSampler, base: str, duration: float) -> Dict[str, Any]:
+        """Writes collapsed stacks (flamegraph.pl / speedscope input) and attribution"""
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        by_stage: Dict[str, Dict[str, float]] = {}
+        for (stage, kind), count in sampler.attribution.items():
+            by_stage.setdefault(stage, {})[kind] = round(count * sampler.interval, 4)
+        return {
+            "samples": sampler.samples,
+            "interval": sampler.interval,
+            "threads": "request",
+            "by_stage": by_stage,
+            "files": [base + ".collapsed"]
+        }
+
+    def _write_cprofile(self, profile: cProfile.Profile, base: str, duration: float) -> Dict[str, Any]:
+        """Writes pstats file and per-node/tool cumulative times"""
+        profile.dump_stats(base + ".prof")
+        stats = pstats.Stats(profile).stats
+        by_stage: Dict[str, Dict[str, float]] = {}
+        for (filename, _, function), (_, _, _, cumulative, _) in stats.items():
+            if function in NODE_FUNCTIONS:
+                by_stage.setdefault(function[:-len("_node")], {})["total"] = round(cumulative, 4)
+            elif function in TOOL_FUNCTIONS and filename.startswith(SRC_DIR):
+                by_stage.setdefault("tools", {})[function] = round(cumulative, 4)
+        return {
+            # cProfile only sees the calling thread; work on pool threads shows up as waiting
+            "threads": "calling thread",
+            "by_stage": by_stage,
+            "files": [base + ".prof"]
+        }
+
+    def _apply_retention(self):
+        """Keeps output files of the newest `keep` profiled requests"""
+        runs: Dict[str, float] = {}
+        for name in os.listdir(self.output_dir):
+            stem, ext = os.path.splitext(name)
+            if ext in (".json", ".collapsed", ".prof"):
+                path = os.path.join(self.output_dir, name)
+                runs[stem] = max(runs.get(stem, 0.0), os.path.getmtime(path))
+        for stem in sorted(runs, key=runs.get, reverse=True)[self.keep:]:
+            for ext in (".json", ".collapsed", ".prof"):
+                path = os.path.join(self.output_dir, stem + ext)
+                if os.path.exists(path):
+                    os.remove(path)
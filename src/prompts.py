@@ -0,0 +1,259 @@
+"""Versioned agent prompts and prompt-cache accounting
+
+Layout since version 2: the system message holds only static instructions, so it forms an
+identical prefix for every call of an agent and stays in the server's prefix (KV) cache.
+Volatile parts (history context, tool facts) follow in the human message, before the query.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.prompts import ChatPromptTemplate
+
+
+class PromptSpec:
+    """One registered prompt version"""
+
+    def __init__(self, name: str, version: str, system: str, human: str, note: str = ""):
+        self.name = name
+        self.version = version
+        self.system = system
+        self.human = human
+        self.note = note
+
+    def messages(self, system_suffix: str = "") -> List[Tuple[str, str]]:
+        """Returns (role, template) pairs for ChatPromptTemplate"""
+        return [("system", self.system + system_suffix), ("human", self.human)]
+
+
+PROMPT_REGISTRY: Dict[str, Dict[str, PromptSpec]] = {}
+
+
+def register_prompt(name: str, version: str, system: str, human: str = "{query}", note: str = "") -> PromptSpec:
+    """Adds prompt version to the registry"""
+    spec = PromptSpec(name, version, system, human, note)
+    PROMPT_REGISTRY.setdefault(name, {})[version] = spec
+    return spec
+
+
+def _pinned_versions() -> Dict[str, str]:
+    """Reads PROMPT_VERSIONS, e.g. "theory=1,code=1" """
+    pinned = {}
+    for item in os.getenv("PROMPT_VERSIONS", "").split(","):
+        if "=" in item:
+            name, version = item.split("=", 1)
+            pinned[name.strip()] = version.strip()
+    return pinned
+
+
+def get_prompt(name: str, version: Optional[str] = None) -> PromptSpec:
+    """Returns requested, pinned (PROMPT_VERSIONS) or latest version of a prompt"""
+    versions = PROMPT_REGISTRY[name]
+    version = version or _pinned_versions().get(name) or max(versions, key=int)
+    return versions[version]
+
+
+def build_prompt(name: str, version: Optional[str] = None, system_suffix: str = "") -> ChatPromptTemplate:
+    """Builds ChatPromptTemplate for a registered prompt"""
+    return ChatPromptTemplate.from_messages(get_prompt(name, version).messages(system_suffix))
+
+
+def active_versions() -> Dict[str, str]:
+    """Returns the active version of every registered prompt"""
+    return {name: get_prompt(name).version for name in PROMPT_REGISTRY}
+
+
+# Router (no volatile parts: one version per variant)
+ROUTER_HEADER = """You are an intelligent router of the StudyCoder Assistant multi-agent system.
+            Your task is to classify user queries into one of categories.
+
+            Categories:
+            1. theory - theoretical questions (what is, explain, definition, concept)
+            2. code - programming questions (write code, function, fix error, how to do)
+            3. planning - planning questions (create plan, schedule, organize, plan)
+            4. general - general questions (hello, help, information, system capabilities)
+            """
+
+ROUTER_EXAMPLES = """
+            Examples:
+            - "What is Python?" → theory
+            - "Write factorial function" → code
+            - "Create learning plan for a week" → planning
+            - "Hello, tell about yourself" → general
+            """
+
+register_prompt("router", "1", ROUTER_HEADER + """
+            Return ONLY one word: theory, code, planning or general.
+            Do not add any explanations.
+            """ + ROUTER_EXAMPLES)
+
+register_prompt("router_multi", "1", ROUTER_HEADER + """
+            Return ONLY category words. If the query clearly asks for several different things,
+            return up to 3 categories separated by commas in the order they are asked (e.g. theory,code).
+            Otherwise return one word: theory, code, planning or general.
+            Do not add any explanations.
+            """ + ROUTER_EXAMPLES + """- "Explain recursion and write factorial function" → theory,code
+""")
+
+# Specialists: version 1 interpolates volatile parts into the system message (legacy layout)
+THEORY_INSTRUCTIONS = """You are an expert in programming theory, algorithms and computer science.
+
+            Your tasks:
+            1. Explain concepts clearly and in detail
+            2. Use examples and analogies
+            3. Structure response (introduction, main part, conclusion)
+            4. Highlight key terms
+            5. Give practical recommendations
+            """
+
+register_prompt("theory", "1", THEORY_INSTRUCTIONS + """
+            Previous discussion context: {context}
+
+            Reference facts from search_knowledge_base tool: {facts}
+
+            Ground your answer in the reference facts when they are given.
+            If information is insufficient, supplement with your knowledge.
+            """, note="legacy layout")
+
+register_prompt("theory", "2", THEORY_INSTRUCTIONS + """
+            The message contains previous discussion context and reference facts
+            from search_knowledge_base tool, followed by the question.
+            Ground your answer in the reference facts when they are given.
+            If information is insufficient, supplement with your knowledge.
+            """, human="""Previous discussion context: {context}
+
+Reference facts from search_knowledge_base tool: {facts}
+
+Question: {query}""", note="static system prefix")
+
+CODE_INSTRUCTIONS = """You are an experienced programmer assistant, Python expert.
+
+            Response requirements:
+            1. Provide complete, working code
+            2. Add comments for explanation
+            3. Explain logic and key points
+            4. Consider best practices (PEP 8)
+            5. Warn about possible errors
+            6. Suggest alternative solutions
+            """
+
+register_prompt("code", "1", CODE_INSTRUCTIONS + """
+            Previous discussion context: {context}
+
+            Use execute_python_code tool to test code.
+            Show code execution results to user.
+            """, note="legacy layout")
+
+register_prompt("code", "2", CODE_INSTRUCTIONS + """
+            The message contains previous discussion context, followed by the question.
+            Use execute_python_code tool to test code.
+            Show code execution results to user.
+            """, human="""Previous discussion context: {context}
+
+Question: {query}""", note="static system prefix")
+
+PLANNER_INSTRUCTIONS = """You are an expert in planning and time management.
+
+            Your tasks:
+            1. Create realistic and achievable plans
+            2. Break big goals into small steps
+            3. Consider time constraints
+            4. Add time for rest and review
+            5. Suggest productivity methods (Pomodoro, Eisenhower Matrix)
+            """
+
+register_prompt("planner", "1", PLANNER_INSTRUCTIONS + """
+            Previous discussion context: {context}
+
+            Structured plan from create_study_plan tool: {facts}
+
+            Build on the structured plan when it is given.
+            Adapt plan to specific user needs.
+            """, note="legacy layout")
+
+register_prompt("planner", "2", PLANNER_INSTRUCTIONS + """
+            The message contains previous discussion context and a structured plan
+            from create_study_plan tool, followed by the request.
+            Build on the structured plan when it is given.
+            Adapt plan to specific user needs.
+            """, human="""Previous discussion context: {context}
+
+Structured plan from create_study_plan tool: {facts}
+
+Request: {query}""", note="static system prefix")
+
+GENERAL_INSTRUCTIONS = """You are a friendly and helpful assistant of StudyCoder Assistant multi-agent system.
+
+            System information:
+            - Name: StudyCoder Assistant
+            - 5 specialized agents: Router, Theory, Code, Planner, General
+            - 3 tools: code execution, knowledge search, plan creation
+            - Memory: saves interaction history
+            - Uses model: qwen3-32b via LiteLLM server
+            """
+
+register_prompt("general", "1", GENERAL_INSTRUCTIONS + """
+            Previous discussion context: {context}
+
+            Be polite, helpful and informative.
+            If question is not in your specialization, suggest contacting appropriate agent.
+            """, note="legacy layout")
+
+register_prompt("general", "2", GENERAL_INSTRUCTIONS + """
+            The message contains previous discussion context, followed by the question.
+            Be polite, helpful and informative.
+            If question is not in your specialization, suggest contacting appropriate agent.
+            """, human="""Previous discussion context: {context}
+
+Question: {query}""", note="static system prefix")
+
+
+class PromptCacheAccounting:
+    """Per-agent prompt vs cached prompt tokens reported by the backend"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.agents: Dict[str, Dict[str, int]] = {}
+
+    def handler(self, agent: str) -> "AgentUsageHandler":
+        """Returns callback handler recording usage for agent"""
+        return AgentUsageHandler(agent, self)
+
+    def record(self, agent: str, prompt_tokens: int, cached_tokens: int):
+        with self._lock:
+            stats = self.agents.setdefault(agent, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+
+    def get_statistics(self) -> Dict[str, Any]:
+        with self._lock:
+            agents = {name: dict(stats) for name, stats in self.agents.items()}
+        for stats in agents.values():
+            stats["cached_ratio"] = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        prompt_tokens = sum(stats["prompt_tokens"] for stats in agents.values())
+        cached_tokens = sum(stats["cached_tokens"] for stats in agents.values())
+        return {
+            "prompt_versions": active_versions(),
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "cached_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+            "agents": agents
+        }
+
+
+class AgentUsageHandler(BaseCallbackHandler):
+    """Reads usage metadata of an agent's LLM responses"""
+
+    def __init__(self, agent: str, accounting: PromptCacheAccounting):
+        self.agent = agent
+        self.accounting = accounting
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+                    self.accounting.record(self.agent, usage.get("input_tokens", 0), cached or 0)
@@ -0,0 +1,231 @@
+"""Client-side resilience for LLM calls: adaptive concurrency, retries and hedging"""
+
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Union
+
+import openai
+from profiling import propagate
+
+# Failures worth retrying: the request may succeed on another attempt or replica
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+Deadline = Union[float, Callable[[], Optional[float]], None]
+
+# HTTP timeout of the LLM call of the current attempt, set by ResilientChain around each call
+_attempt_timeout: contextvars.ContextVar = contextvars.ContextVar("llm_attempt_timeout", default=None)
+
+
+def attempt_timeout() -> Optional[float]:
+    """Returns the timeout the running attempt allows its LLM call (None outside ResilientChain)"""
+    return _attempt_timeout.get()
+
+
+def _resolve(deadline: Deadline) -> Optional[float]:
+    return deadline() if callable(deadline) else deadline
+
+
+class LatencyWindow:
+    """Rolling window of recent call latencies"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> float:
+        """Returns latency percentile (0 if there are no samples)"""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit driven by observed latency and errors"""
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 latency_tolerance: float = 2.0, backoff_ratio: float = 0.5):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self.stats = {"increases": 0, "decreases": 0, "rejections": 0}
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Waits for a free slot"""
+        with self._condition:
+            acquired = self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout)
+            if acquired:
+                self.in_flight += 1
+            else:
+                self.stats["rejections"] += 1
+            return acquired
+
+    def try_acquire(self) -> bool:
+        """Takes a slot only if one is free right now"""
+        return self.acquire(timeout=0)
+
+    def release(self, latency: float, ok: bool, baseline: float = 0.0):
+        """Frees a slot and adjusts the limit (baseline is the caller's typical latency)"""
+        with self._condition:
+            self.in_flight -= 1
+            # Overloaded: error or latency far above the chain's recent median
+            if not ok or (baseline and latency > baseline * self.latency_tolerance):
+                # At most one decrease per round trip: calls started before the last
+                # decrease report congestion that has already been acted on
+                now = time.monotonic()
+                if now - latency >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self._last_decrease = now
+                    self.stats["decreases"] += 1
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.stats["increases"] += 1
+            self._condition.notify_all()
+
+    def get_statistics(self) -> Dict[str, Any]:
+        with self._condition:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight, **self.stats}
+
+
+class ResilientChain:
+    """Chain wrapper with concurrency limiting, jittered retries and optional hedging"""
+
+    def __init__(self, name: str, chain, limiter: AdaptiveLimiter, executor: ThreadPoolExecutor,
+                 retries: int = 2, backoff_base: float = 0.2, backoff_cap: float = 2.0,
+                 hedge: bool = False, hedge_percentile: float = 95, hedge_min_samples: int = 20,
+                 attempt_timeout: Optional[float] = None):
+        self.name = name
+        self.chain = chain
+        self.limiter = limiter
+        self.executor = executor
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        # Cap of one attempt's LLM call; the remaining deadline lowers it further
+        self.attempt_timeout = attempt_timeout
+        self.window = LatencyWindow()
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "retries": 0, "hedges": 0, "hedge_wins": 0}
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[Dict] = None,
+               timeout: Optional[float] = None) -> Any:
+        """Invokes chain with retries on transient failures, waiting at most timeout seconds"""
+        if timeout is None:
+            return self.invoke_until(inputs, config)
+        # Own thread rather than the hedge pool, which the call itself may need
+        future = Future()
+        deadline = time.monotonic() + timeout
+
+        def run():
+            try:
+                future.set_result(self.invoke_until(inputs, config, deadline))
+            except BaseException as error:
+                future.set_exception(error)
+
+        threading.Thread(target=propagate(run), name=f"{self.name}-call", daemon=True).start()
+        return future.result(timeout)
+
+    def invoke_until(self, inputs: Dict[str, Any], config: Optional[Dict] = None,
+                     deadline: Deadline = None) -> Any:
+        """Invokes chain on the calling thread; no retry is started that could not finish before the deadline
+
+        deadline is a time.monotonic() value, or a callable returning it when it can move while the call runs.
+        """
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            try:
+                return self._attempt(inputs, config, deadline)
+            except TRANSIENT_ERRORS:
+                # Full jitter exponential backoff
+                backoff = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                limit = _resolve(deadline)
+                if attempt == self.retries or (limit and time.monotonic() + backoff >= limit):
+                    raise
+                self._count("retries")
+                time.sleep(backoff)
+
+    def _attempt(self, inputs: Dict[str, Any], config: Optional[Dict], deadline: Deadline = None) -> Any:
+        """Single attempt, hedged after a p95-derived delay when enabled"""
+        if not self.hedge or len(self.window) < self.hedge_min_samples:
+            return self._call(inputs, config, deadline)
+
+        primary = self.executor.submit(propagate(self._call), inputs, config, deadline)
+        done, _ = wait([primary], timeout=self.window.percentile(self.hedge_percentile))
+        if done or not self.limiter.try_acquire():
+            return primary.result()
+
+        self._count("hedges")
+        hedge = self.executor.submit(propagate(self._call), inputs, config, deadline, True)
+        pending = {primary, hedge}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # First successful response wins; the loser finishes in the background
+            succeeded = [future for future in done if future.exception() is None]
+            if succeeded:
+                if hedge in succeeded:
+                    self._count("hedge_wins")
+                return succeeded[0].result()
+            if not pending:
+                return done.pop().result()
+
+    def _call(self, inputs: Dict[str, Any], config: Optional[Dict], deadline: Deadline = None,
+              acquired: bool = False) -> Any:
+        """Calls chain inside a concurrency slot; the LLM call ends by the deadline or the attempt cap"""
+        if not acquired:
+            self.limiter.acquire()
+        baseline = self.window.percentile(50) if len(self.window) >= 10 else 0.0
+        start = time.monotonic()
+        ok = True
+        limit = _resolve(deadline)
+        timeout = self.attempt_timeout
+        if limit is not None:
+            timeout = max(min(timeout or float("inf"), limit - start), 0.01)
+        token = _attempt_timeout.set(timeout)
+        try:
+            result = self.chain.invoke(inputs, config)
+            self.window.add(time.monotonic() - start)
+            return result
+        except TRANSIENT_ERRORS:
+            ok = False
+            self._count("errors")
+            raise
+        finally:
+            _attempt_timeout.reset(token)
+            self.limiter.release(time.monotonic() - start, ok, baseline)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get_statistics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["p95_latency"] = round(self.window.percentile(95), 3)
+        return stats
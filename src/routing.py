@@ -0,0 +1,77 @@
+"""Router output parsing and keyword classification"""
+
+import re
+from typing import List
+
+VALID_CATEGORIES = ["theory", "code", "planning", "general"]
+
+# Most categories a multi-intent query is split into
+MAX_INTENTS = 3
+
+# Enum output for multi-intent routing, e.g. "theory,code" (vLLM guided_regex)
+MULTI_INTENT_REGEX = "({0})(,({0})){{0,{1}}}".format("|".join(VALID_CATEGORIES), MAX_INTENTS - 1)
+
+# Keywords used when the router has to classify without the LLM
+CATEGORY_KEYWORDS = {
+    "code": ["write", "code", "function", "implement", "fix", "error", "bug", "script", "python program"],
+    "planning": ["plan", "schedule", "organize", "week", "days", "roadmap"],
+    "theory": ["what is", "what are", "explain", "definition", "difference", "concept", "why", "how does"],
+    "general": ["hello", "hi ", "help", "tell me about", "yourself", "your system"],
+}
+
+_THINK_BLOCK = re.compile(r"<think>.*?(</think>|$)", re.DOTALL | re.IGNORECASE)
+_LABEL = re.compile(r"\b(" + "|".join(VALID_CATEGORIES) + r")\b")
+
+
+def strip_reasoning(text: str) -> str:
+    """Removes <think> reasoning blocks emitted by reasoning models"""
+    return _THINK_BLOCK.sub(" ", text)
+
+
+def parse_categories(text: str, limit: int = 1) -> List[str]:
+    """Returns valid category labels in order of appearance (first valid label wins)"""
+    found = []
+    for match in _LABEL.finditer(strip_reasoning(text).lower()):
+        label = match.group(1)
+        if label not in found:
+            found.append(label)
+            if len(found) >= limit:
+                break
+    return found
+
+
+def parse_category(text: str, default: str = "general") -> str:
+    """Returns the first valid category label or default"""
+    found = parse_categories(text)
+    return found[0] if found else default
+
+
+def _specialist_intents(categories: List[str]) -> List[str]:
+    """Drops "general" when a specialist category is present (it is a fallback, not an intent)"""
+    specialists = [category for category in categories if category != "general"]
+    return specialists[:MAX_INTENTS] if specialists else categories[:1]
+
+
+def parse_intents(text: str) -> List[str]:
+    """Returns categories of a multi-intent router output"""
+    return _specialist_intents(parse_categories(text, limit=len(VALID_CATEGORIES))) or ["general"]
+
+
+def match_categories(query: str) -> List[str]:
+    """Returns all categories with keyword hits, in order of first mention in query"""
+    query_lower = query.lower()
+    positions = {}
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        hits = [query_lower.find(keyword) for keyword in keywords if keyword in query_lower]
+        if hits:
+            positions[category] = min(hits)
+    return _specialist_intents(sorted(positions, key=positions.get))
+
+
+def classify_by_keywords(query: str) -> str:
+    """Classifies query locally by keywords"""
+    query_lower = query.lower()
+    for category in ["planning", "code", "theory", "general"]:
+        if any(keyword in query_lower for keyword in CATEGORY_KEYWORDS[category]):
+            return category
+    return "general"
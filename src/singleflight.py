@@ -0,0 +1,104 @@
+"""In-flight request coalescing for identical concurrent LLM calls"""
+
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from profiling import propagate
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes query text for coalescing (case, whitespace, trailing punctuation)"""
+    return _WHITESPACE.sub(" ", query).strip().rstrip("?!. ").lower()
+
+
+def fingerprint(name: str, inputs: Dict[str, Any]) -> str:
+    """Builds coalescing key from chain name, normalized query and other inputs"""
+    digest = hashlib.sha256(name.encode())
+    digest.update(b"\0" + normalize_query(str(inputs.get("query", ""))).encode())
+    for field in sorted(k for k in inputs if k != "query"):
+        digest.update(f"\0{field}={inputs[field]}".encode())
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Shares one in-flight call between concurrent callers with the same key"""
+
+    def __init__(self, max_workers: int = 16):
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        # Latest deadline (time.monotonic()) among the callers of each in-flight call; None is unbounded
+        self._deadlines: Dict[str, Optional[float]] = {}
+        # Shared calls run on their own threads so that a waiter giving up never cancels them
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="singleflight")
+        self.stats = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    def submit(self, key: str, fn: Callable, *args, deadline: Optional[float] = None) -> Future:
+        """Returns the in-flight future for key, starting fn if there is none"""
+        with self._lock:
+            self.stats["calls"] += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                current = self._deadlines.get(key)
+                if current is not None:
+                    self._deadlines[key] = None if deadline is None else max(current, deadline)
+                return future
+            self._deadlines[key] = deadline
+            future = self._executor.submit(propagate(fn), *args)
+            self._inflight[key] = future
+            self.stats["executions"] += 1
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def do(self, key: str, fn: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Runs fn once per key among concurrent callers and returns its result"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        return self.submit(key, fn, *args, deadline=deadline).result(timeout)
+
+    def deadline(self, key: str) -> Optional[float]:
+        """Latest deadline among the callers waiting for the in-flight call of key"""
+        with self._lock:
+            return self._deadlines.get(key)
+
+    def _forget(self, key: str, future: Future):
+        """Removes finished call so later requests start a fresh one"""
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                self._deadlines.pop(key, None)
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Returns coalescing statistics"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self._inflight)
+        stats["saved_calls"] = stats["coalesced"]
+        stats["coalesce_rate"] = stats["coalesced"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+class CoalescedChain:
+    """Chain wrapper that coalesces identical concurrent invocations"""
+
+    def __init__(self, name: str, chain, flight: SingleFlight):
+        self.name = name
+        self.chain = chain
+        self.flight = flight
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[Dict] = None,
+               timeout: Optional[float] = None) -> Any:
+        """Invokes chain, sharing the call with identical concurrent requests
+
+        The shared call runs with the config of the caller that started it: a coalesced waiter's
+        config (callbacks, ledger metadata) is dropped, so the call is attributed to that request only.
+        """
+        # The shared call is not bound to this caller's timeout: other waiters may have more time.
+        # Its retries stop at the latest deadline among the waiters.
+        key = fingerprint(self.name, inputs)
+        return self.flight.do(key, self.chain.invoke_until, inputs, config, lambda: self.flight.deadline(key),
+                              timeout=timeout)
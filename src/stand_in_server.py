@@ -0,0 +1,179 @@
+"""Local OpenAI-compatible stand-in server with simulated prefix (KV) caching
+
+Answers come from FakeChatModel. The prompt is split into blocks of whitespace tokens and each
+block is hashed together with everything before it, as vLLM automatic prefix caching does:
+a request reuses cached blocks up to the first block whose prefix differs. Cached tokens are
+reported in usage.prompt_tokens_details.cached_tokens and skip the simulated prefill time.
+
+Usage: python src/stand_in_server.py [--port 34001]
+       LLM_BACKEND=litellm LITELLM_BASE_URL=http://127.0.0.1:34001/v1 python src/main.py
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from langchain_core.messages import convert_to_messages
+from fake_llm import FakeChatModel
+from prompts import PROMPT_REGISTRY
+
+
+class PrefixCache:
+    """LRU cache of hashed prompt blocks"""
+
+    def __init__(self, block_size: int = 16, capacity: int = 4096):
+        self.block_size = block_size
+        self.capacity = capacity
+        self._blocks: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    def lookup(self, tokens: List[str]) -> int:
+        """Returns number of cached prompt tokens and caches the full blocks of the prompt"""
+        cached, matching = 0, True
+        digest = hashlib.sha256()
+        with self._lock:
+            for start in range(0, len(tokens) - self.block_size + 1, self.block_size):
+                digest.update("\0".join(tokens[start:start + self.block_size]).encode() + b"\1")
+                key = digest.hexdigest()
+                if matching and key in self._blocks:
+                    self._blocks.move_to_end(key)
+                    cached += self.block_size
+                    continue
+                matching = False
+                self._blocks[key] = True
+                if len(self._blocks) > self.capacity:
+                    self._blocks.popitem(last=False)
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += len(tokens)
+            self.stats["cached_tokens"] += cached
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+
+def prompt_tokens(messages: List[Dict[str, Any]]) -> List[str]:
+    """Tokenizes chat messages the way FakeChatModel counts tokens, with a role marker per message"""
+    tokens = []
+    for message in messages:
+        tokens.append(f"<|{message.get('role', 'user')}|>")
+        tokens.extend(str(message.get("content", "")).split())
+    return tokens
+
+
+def request_agent(messages: List[Dict[str, Any]]) -> str:
+    """Names the agent of a request by matching its system message against the registered prompts"""
+    system = next((str(m.get("content", "")) for m in messages if m.get("role") == "system"), "")
+    for name, versions in PROMPT_REGISTRY.items():
+        # Legacy prompt versions append context to the system message, so match by prefix
+        if any(system.startswith(spec.system.split("{")[0]) for spec in versions.values()):
+            return "router" if name.startswith("router") else name
+    return ""
+
+
+class StandInServer:
+    """OpenAI-compatible /v1/chat/completions endpoint on a background thread"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, block_size: int = 16, cache_blocks: int = 4096,
+                 latency: float = 0.02, token_latency: float = 0.001, prefill_token_latency: float = 0.0002):
+        self.cache = PrefixCache(block_size, cache_blocks)
+        self.model = FakeChatModel(latency=latency, token_latency=token_latency)
+        self.prefill_token_latency = prefill_token_latency
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stand-in-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def complete(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds chat completion response for a request body"""
+        tokens = prompt_tokens(body["messages"])
+        cached = self.cache.lookup(tokens)
+        # Prefill only has to process the uncached part of the prompt
+        time.sleep(self.prefill_token_latency * (len(tokens) - cached))
+
+        params = {"max_tokens": body.get("max_completion_tokens") or body.get("max_tokens"),
+                  "agent": request_agent(body["messages"])}
+        # The OpenAI client merges extra_body into the top level of the request
+        guided = {key: body[key] for key in ("guided_choice", "guided_regex") if key in body}
+        if guided:
+            params["extra_body"] = guided
+        stop = body.get("stop")
+        result = self.model._generate(convert_to_messages(body["messages"]),
+                                      stop=[stop] if isinstance(stop, str) else stop, **params)
+        message = result.generations[0].message
+        completion_tokens = message.usage_metadata["output_tokens"]
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", self.model.model_name),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": message.content},
+                         "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": len(tokens),
+                "completion_tokens": completion_tokens,
+                "total_tokens": len(tokens) + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached}
+            }
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if body.get("stream"):
+                    return self._send(400, {"error": {"message": "Streaming is not supported"}})
+                self._send(200, server.complete(body))
+
+            def _send(self, status: int, payload: Dict[str, Any]):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in server with prefix caching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=34001)
+    parser.add_argument("--block-size", type=int, default=16)
+    args = parser.parse_args()
+
+    server = StandInServer(args.host, args.port, block_size=args.block_size)
+    print(f"Stand-in server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n Stopped. Prefix cache:", server.cache.stats)
@@ -1,5 +1,10 @@
 """Auxiliary functions"""
 
+import asyncio
+import signal
+import sys
+import threading
+from typing import Dict
 from agents import MultiAgentSystem
 
 def interactive_demo(system: MultiAgentSystem):
@@ -10,51 +15,250 @@ def interactive_demo(system: MultiAgentSystem):
     print("• 'stats' - show system statistics")
     print("• 'history' - show interaction history")
     print("• 'info' - show system information")
+    print("• 'perf' - show live per-node latency and cache hit rates")
+    print("• 'profile [sample|cprofile]' - profile the next query")
     print("• 'exit' or 'quit' - exit demonstration")
+    print("Queries are queued while one is running. Ctrl-C cancels the running query.")
     print("="*60)
-    
-    while True:
+
+    try:
+        asyncio.run(AsyncConsole(system).run())
+    except KeyboardInterrupt:
+        print("\n\n Demonstration interrupted.")
+
+class AsyncConsole:
+    """Non-blocking console: queued queries, streamed answers, Ctrl-C cancels the running query"""
+
+    def __init__(self, system: MultiAgentSystem):
+        self.system = system
+        self.pending: asyncio.Queue = None
+        self.current: asyncio.Task = None
+        self.profile_next = None
+        self.done: asyncio.Event = None
+        self.interrupted = False  # Set when Ctrl-C cancels the running query
+
+    async def run(self):
+        """Runs console until exit"""
+        loop = asyncio.get_running_loop()
+        self.pending = asyncio.Queue()
+        self.done = asyncio.Event()
+
+        # Ctrl-C cancels the running query instead of exiting
         try:
-            user_input = input("\n Your query: ").strip()
-            
-            if not user_input:
-                continue
-                
-            # Check commands
-            if user_input.lower() in ['exit', 'quit', 'q']:
-                print("\n Goodbye! Thank you for using StudyCoder Assistant!")
+            loop.add_signal_handler(signal.SIGINT, self._on_interrupt)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl-C keeps its default behaviour
+
+        lines: asyncio.Queue = asyncio.Queue()
+        threading.Thread(target=self._read_input, args=(loop, lines), name="console-input", daemon=True).start()
+        worker = asyncio.create_task(self._worker())
+
+        print("\n Your query: ", end="", flush=True)
+        end_of_input = False
+        while not self.done.is_set():
+            line_task = asyncio.create_task(lines.get())
+            done_task = asyncio.create_task(self.done.wait())
+            finished, _ = await asyncio.wait({line_task, done_task}, return_when=asyncio.FIRST_COMPLETED)
+            if line_task not in finished:
+                line_task.cancel()
                 break
-                
-            elif user_input.lower() in ['stats', 'statistics']:
-                stats = system.memory.get_statistics()
-                print(f"\n SYSTEM STATISTICS:")
-                print(f"• Total interactions: {stats['total_interactions']}")
-                print(f"• Categories used: {stats['categories_used']}")
-                print(f"• Agents used: {stats['agents_used']}")
-                print(f"• Tools used: {stats['unique_tools_used']}")
-                continue
-                
-            elif user_input.lower() in ['history', 'hist']:
-                print(f"\n INTERACTION HISTORY:")
-                for i, interaction in enumerate(system.memory.interactions[-5:], 1):
-                    print(f"{i}. [{interaction['agent']}] {interaction['query'][:50]}...")
-                continue
-                
-            elif user_input.lower() in ['info', 'system']:
-                info = system.get_system_info()
-                print(f"\n SYSTEM INFORMATION:")
-                print(f"• Version: {info['version']}")
-                print(f"• LLM: {info['llm_config']['model']}")
-                print(f"• Temperature: {info['llm_config']['temperature']}")
-                print(f"• Agents: {', '.join(info['agents'])}")
-                continue
-            
-            # Process regular query
-            result = system.process(user_input)
-            print(result["formatted"])
-            
-        except KeyboardInterrupt:
-            print("\n\n Demonstration interrupted.")
-            break
-        except Exception as e:
-            print(f"\n Error: {e}")
\ No newline at end of file
+            done_task.cancel()
+
+            user_input = line_task.result()
+            if user_input is None:  # EOF
+                end_of_input = True
+                break
+            user_input = user_input.strip()
+            if user_input and not self._handle_command(user_input):
+                await self.pending.put((user_input, self.profile_next))
+                self.profile_next = None
+                if self.current is not None:
+                    print(f" Queued ({self.pending.qsize()} waiting)")
+
+        # End of piped input answers the queued queries first (Ctrl-C still stops them)
+        if end_of_input:
+            drained = asyncio.create_task(self.pending.join())
+            done_task = asyncio.create_task(self.done.wait())
+            await asyncio.wait({drained, done_task}, return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+            done_task.cancel()
+
+        # On exit, queued queries are dropped; the worker stops with the running query
+        while not self.pending.empty():
+            self.pending.get_nowait()
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        try:
+            loop.remove_signal_handler(signal.SIGINT)
+        except (NotImplementedError, RuntimeError):
+            pass
+        print("\n Goodbye! Thank you for using StudyCoder Assistant!")
+
+    @staticmethod
+    def _read_input(loop: asyncio.AbstractEventLoop, lines: asyncio.Queue):
+        """Reads stdin lines on a thread so that the event loop never blocks"""
+        while True:
+            line = sys.stdin.readline()
+            loop.call_soon_threadsafe(lines.put_nowait, line if line else None)
+            if not line:
+                return
+
+    def _on_interrupt(self):
+        """Cancels the running query, or exits when nothing is running"""
+        if self.current is not None and not self.current.done():
+            self.interrupted = True
+            self.current.cancel()
+        else:
+            self.done.set()
+
+    async def _worker(self):
+        """Processes queued queries one at a time"""
+        while True:
+            query, profile = await self.pending.get()
+            self.current = asyncio.create_task(self._run_query(query, profile))
+            try:
+                await self.current
+            except asyncio.CancelledError:
+                # Only Ctrl-C moves on to the next query; exit cancels the worker itself
+                if not self.interrupted:
+                    raise
+                print(f"\n Query cancelled: '{query[:50]}'")
+            except Exception as e:
+                print(f"\n Error: {e}")
+            finally:
+                self.current = None
+                self.interrupted = False
+                self.pending.task_done()
+            print("\n Your query: ", end="", flush=True)
+
+    async def _run_query(self, query: str, profile):
+        """Streams one query; cancellation stops the graph before its next step"""
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def post(event):
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, event)
+            except RuntimeError:
+                pass  # Console exited while the query was still running
+
+        def produce():
+            try:
+                if profile:
+                    # Profiled requests run to completion as a whole
+                    post(("result", self.system.process(query, profile=profile)))
+                else:
+                    stream = self.system.stream(query)
+                    for event in stream:
+                        post(event)
+                        if cancelled.is_set():
+                            stream.close()
+                            break
+            except Exception as e:
+                post(("error", e))
+            finally:
+                post(("end", None))
+
+        threading.Thread(target=produce, name="console-query", daemon=True).start()
+        # Tokens of one agent are printed as they arrive; others are buffered until it finishes
+        streamed: Dict[str, str] = {}
+        finished = set()
+        live = None
+        try:
+            while True:
+                kind, data = await events.get()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise data
+                if kind == "token":
+                    agent, text = data["agent"], data["text"]
+                    if text is None:  # Failed attempt: the retry starts over
+                        streamed[agent] = ""
+                        if agent == live:
+                            print(f"\n [{agent.capitalize()} Agent answer, retrying]")
+                        continue
+                    streamed[agent] = streamed.get(agent, "") + text
+                    if live is None and agent not in finished:
+                        live = agent
+                        print(f"\n [{agent.capitalize()} Agent answer]\n{streamed[agent]}", end="", flush=True)
+                    elif agent == live:
+                        print(text, end="", flush=True)
+                elif kind == "answer":
+                    agent = data["agent"]
+                    finished.add(agent)
+                    if agent == live:
+                        live = None
+                        if data["answer"] == streamed.get(agent):
+                            print()
+                            continue
+                    print(f"\n [{agent.capitalize()} Agent answer]\n{data['answer']}")
+                elif kind == "result":
+                    result = data
+                    print(f"\n Done: {', '.join(result.categories)} | agents: {' → '.join(result.agents_used)} | "
+                          f"tools: {', '.join(result.tools_used) or 'none'} | {result.total_execution_time:.2f} sec"
+                          + (f" | degraded: {', '.join(result.degraded_stages)}" if result.degraded else ""))
+                    if profile:
+                        print(result.formatted)
+        finally:
+            cancelled.set()
+
+    def _handle_command(self, user_input: str) -> bool:
+        """Runs console command; returns False for regular queries"""
+        command = user_input.lower()
+        system = self.system
+
+        # Check commands
+        if command in ['exit', 'quit', 'q']:
+            self.done.set()
+            return True
+
+        elif command in ['stats', 'statistics']:
+            stats = system.memory.get_statistics()
+            print(f"\n SYSTEM STATISTICS:")
+            print(f"• Total interactions: {stats['total_interactions']}")
+            print(f"• Categories used: {stats['categories_used']}")
+            print(f"• Agents used: {stats['agents_used']}")
+            print(f"• Tools used: {stats['unique_tools_used']}")
+
+        elif command in ['history', 'hist']:
+            print(f"\n INTERACTION HISTORY:")
+            for i, interaction in enumerate(system.memory.interactions[-5:], 1):
+                print(f"{i}. [{interaction['agent']}] {interaction['query'][:50]}...")
+
+        elif command in ['info', 'system']:
+            info = system.get_system_info()
+            print(f"\n SYSTEM INFORMATION:")
+            print(f"• Version: {info['version']}")
+            print(f"• LLM: {info['llm_config']['model']}")
+            print(f"• Temperature: {info['llm_config']['temperature']}")
+            print(f"• Agents: {', '.join(info['agents'])}")
+            prompt_cache = info['prompt_cache']
+            print(f"• Prompt cache: {prompt_cache['cached_ratio']:.0%} of {prompt_cache['prompt_tokens']} prompt tokens cached")
+
+        elif command in ['perf', 'performance']:
+            perf = system.get_performance_stats()
+            print(f"\n PERFORMANCE (live):")
+            for node, stats in perf['nodes'].items():
+                print(f"• {node:<8} calls {stats['count']:4d} | p50 {stats['p50']:.2f} sec | p95 {stats['p95']:.2f} sec")
+            coalescing = perf['coalescing']
+            print(f"• Coalescing: {coalescing['coalesce_rate']:.0%} of {coalescing['calls']} agent calls shared "
+                  f"({coalescing['in_flight']} in flight)")
+            print(f"• Router fallback cache: {perf['router_cache']['hit_rate']:.0%} hit rate "
+                  f"({perf['router_cache']['hits']} hits)")
+            print(f"• LLM concurrency limit: {perf['limiter']['limit']} ({perf['limiter']['in_flight']} in flight)")
+            print(f"• Queue: {self.pending.qsize()} waiting, {'1 running' if self.current else 'idle'}")
+
+        elif command.split() in (['profile'], ['profile', 'sample'], ['profile', 'cprofile']):
+            # Anything else starting with "profile" is a query
+            parts = command.split()
+            self.profile_next = parts[1] if len(parts) > 1 else True
+            print(f"\n Next query will be profiled (output: {system.profiler.output_dir})")
+
+        else:
+            return False
+
+        if self.current is None:
+            print("\n Your query: ", end="", flush=True)
+        return True
@@ -0,0 +1,364 @@
+"""Multi-process worker mode with session-affine routing
+
+WorkerPool starts N worker processes, each with its own MultiAgentSystem. Sessions are mapped to
+workers with a consistent hash ring, so a session's memory stays in one process; when a worker
+dies only its sessions move, and its in-flight requests are re-sent to their new workers.
+"""
+
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from config import WorkerConfig, LedgerConfig
+from resilience import LatencyWindow
+
+# ProcessResult fields sent back to the supervisor (lazy fields stay in the worker)
+RESULT_FIELDS = ("query", "category", "categories", "agent", "agents_used", "tools_used", "response",
+                 "agent_execution_time", "total_execution_time", "degraded", "degraded_stages")
+
+
+class WorkerDied(RuntimeError):
+    """Request was lost together with its worker process"""
+
+
+class ConsistentHashRing:
+    """Maps keys to nodes; adding or removing a node only moves that node's keys"""
+
+    def __init__(self, replicas: int = 64):
+        self.replicas = replicas
+        self._hashes: List[int] = []
+        self._owners: Dict[int, str] = {}
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(set(self._owners.values()))
+
+    def add(self, node: str):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if point not in self._owners:
+                bisect.insort(self._hashes, point)
+                self._owners[point] = node
+
+    def remove(self, node: str):
+        points = [point for point, owner in self._owners.items() if owner == node]
+        for point in points:
+            del self._owners[point]
+            self._hashes.pop(bisect.bisect_left(self._hashes, point))
+
+    def get(self, key: str) -> str:
+        """Returns node owning key"""
+        if not self._hashes:
+            raise LookupError("Hash ring is empty")
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[self._hashes[index]]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+def _worker_statistics(system, served: Dict[str, int]) -> Dict[str, Any]:
+    """Collects metrics of a worker's MultiAgentSystem"""
+    stats = system.get_performance_stats()
+    stats.update(served)
+    stats.update({
+        "pid": os.getpid(),
+        "sessions": len(system.sessions),
+        "deadline_hits": dict(system.deadline_hits),
+        "prompt_cache": system.prompt_cache.get_statistics(),
+        "ledger": system.ledger.summary()
+    })
+    return stats
+
+
+def _worker_main(worker_id: str, requests, responses):
+    """Worker process: serves requests from its queue with a local MultiAgentSystem"""
+    if not WorkerConfig.LOG:
+        sys.stdout = open(os.devnull, "w")
+    # One token ledger log per worker: rotation is not safe across processes
+    LedgerConfig.DIR = os.path.join(LedgerConfig.DIR, worker_id)
+    from agents import MultiAgentSystem
+
+    system = MultiAgentSystem()
+    executor = ThreadPoolExecutor(max_workers=WorkerConfig.THREADS, thread_name_prefix="worker")
+    served = {"served": 0, "failed": 0}
+    served_lock = threading.Lock()
+
+    def handle(request_id: int, payload: Dict[str, Any]):
+        try:
+            result = system.process(payload["query"], timeout=payload.get("timeout"),
+                                    session_id=payload.get("session_id"))
+            data = {field: result[field] for field in RESULT_FIELDS}
+            data["worker"] = worker_id
+            with served_lock:
+                served["served"] += 1
+            responses.put((request_id, "ok", data))
+        except Exception as e:
+            with served_lock:
+                served["failed"] += 1
+            responses.put((request_id, "error", f"{type(e).__name__}: {e}"))
+
+    responses.put((None, "ready", os.getpid()))
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, kind, payload = message
+        if kind == "stats":
+            # Answered right away so that busy request threads do not delay metrics
+            with served_lock:
+                counters = dict(served)
+            responses.put((request_id, "ok", _worker_statistics(system, counters)))
+        else:
+            executor.submit(handle, request_id, payload)
+    executor.shutdown(wait=True)
+    # Worker processes exit without running atexit handlers
+    system.ledger.flush()
+
+
+class WorkerPool:
+    """Supervisor of worker processes with session-affine routing"""
+
+    def __init__(self, workers: Optional[int] = None, replicas: Optional[int] = None,
+                 respawn: Optional[bool] = None):
+        self.size = workers or WorkerConfig.WORKERS or os.cpu_count() or 1
+        self.respawn = WorkerConfig.RESPAWN if respawn is None else respawn
+        self.ring = ConsistentHashRing(replicas or WorkerConfig.RING_REPLICAS)
+        # Spawned workers do not inherit the supervisor's threads and locks
+        self._mp = multiprocessing.get_context("spawn")
+        self._workers: Dict[str, Dict[str, Any]] = {}
+        # request_id -> (worker_id, kind, payload, future)
+        self._pending: Dict[int, Tuple[str, str, Dict[str, Any], Future]] = {}
+        # Requests waiting for a worker while none is ready
+        self._backlog: List[Tuple[int, str, Dict[str, Any], Future]] = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self.latency = LatencyWindow()
+        self.stats = {"requests": 0, "errors": 0, "rerouted": 0, "lost": 0, "worker_deaths": 0, "respawns": 0}
+
+    def start(self, timeout: float = 120.0) -> "WorkerPool":
+        """Starts workers and waits until all of them are ready"""
+        print(f"\n Starting {self.size} worker processes...")
+        for i in range(self.size):
+            self._spawn(f"w{i}")
+        threading.Thread(target=self._monitor, name="pool-monitor", daemon=True).start()
+        deadline = time.monotonic() + timeout
+        for worker in list(self._workers.values()):
+            if not worker["ready"].wait(max(0.0, deadline - time.monotonic())):
+                self.close()
+                raise TimeoutError(f"Workers not ready after {timeout} sec")
+        ready = ", ".join(f"{worker_id} (pid {worker['pid']})" for worker_id, worker in self._workers.items())
+        print(f" Workers ready: {ready}")
+        return self
+
+    def _spawn(self, worker_id: str):
+        self._register(worker_id, self._start_process(worker_id))
+
+    def _start_process(self, worker_id: str) -> Dict[str, Any]:
+        """Starts a worker process (slow with the spawn context: called without the lock)"""
+        # Queues per worker: a killed worker can only corrupt its own pipes
+        requests, responses = self._mp.Queue(), self._mp.Queue()
+        process = self._mp.Process(target=_worker_main, args=(worker_id, requests, responses),
+                                   name=f"worker-{worker_id}", daemon=True)
+        process.start()
+        return {"process": process, "requests": requests, "responses": responses, "ready": threading.Event(),
+                "pid": process.pid, "in_flight": 0}
+
+    def _register(self, worker_id: str, worker: Dict[str, Any]):
+        """Makes started worker known to the pool; it joins the ring once ready"""
+        self._workers[worker_id] = worker
+        threading.Thread(target=self._read_responses, args=(worker_id, worker),
+                         name=f"pool-responses-{worker_id}", daemon=True).start()
+
+    def worker_for(self, session_id: str) -> str:
+        """Returns worker currently owning session"""
+        with self._lock:
+            return self.ring.get(session_id)
+
+    def submit(self, query: str, session_id: Optional[str] = None, timeout: Optional[float] = None) -> Future:
+        """Sends query to its session's worker; the future resolves to a result dict"""
+        future = Future()
+        future.started_at = time.monotonic()
+        payload = {"query": query, "session_id": session_id, "timeout": timeout}
+        with self._lock:
+            self.stats["requests"] += 1
+            self._send(next(self._ids), "process", payload, future)
+        return future
+
+    def process(self, query: str, session_id: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Processes query on its session's worker"""
+        return self.submit(query, session_id, timeout).result()
+
+    def _send(self, request_id: int, kind: str, payload: Dict[str, Any], future: Future,
+              worker_id: Optional[str] = None):
+        """Queues request to a worker (caller holds the lock)"""
+        if worker_id is None:
+            if not len(self.ring):
+                self._backlog.append((request_id, kind, payload, future))
+                return
+            if payload.get("session_id") is not None:
+                worker_id = self.ring.get(payload["session_id"])
+            else:
+                # Requests without a session go to the least loaded worker
+                worker_id = min(self.ring.nodes, key=lambda wid: self._workers[wid]["in_flight"])
+        worker = self._workers[worker_id]
+        worker["in_flight"] += 1
+        self._pending[request_id] = (worker_id, kind, payload, future)
+        worker["requests"].put((request_id, kind, payload))
+
+    def _read_responses(self, worker_id: str, worker: Dict[str, Any]):
+        """Resolves futures with responses of one worker"""
+        while True:
+            try:
+                message = worker["responses"].get()
+            except Exception:
+                return  # Pipe broken by a dying worker
+            if message is None:
+                return
+            request_id, status, data = message
+            with self._lock:
+                # Late responses of a dead worker are ignored: its requests were re-sent
+                if self._workers.get(worker_id) is not worker:
+                    return
+                if status == "ready":
+                    self._on_ready(worker_id)
+                    continue
+                entry = self._pending.get(request_id)
+                if entry is None or entry[0] != worker_id:
+                    continue
+                del self._pending[request_id]
+                self._workers[worker_id]["in_flight"] -= 1
+                if status != "ok":
+                    self.stats["errors"] += 1
+            future = entry[3]
+            if status == "ok":
+                if entry[1] == "process":
+                    self.latency.add(time.monotonic() - future.started_at)
+                future.set_result(data)
+            else:
+                future.set_exception(RuntimeError(f"Worker {worker_id}: {data}"))
+
+    def _on_ready(self, worker_id: str):
+        """Adds ready worker to the ring and flushes waiting requests (caller holds the lock)"""
+        self.ring.add(worker_id)
+        self._workers[worker_id]["ready"].set()
+        backlog, self._backlog = self._backlog, []
+        for request_id, kind, payload, future in backlog:
+            self._send(request_id, kind, payload, future)
+
+    def _monitor(self):
+        """Detects dead workers, rebalances their sessions and starts replacements"""
+        while not self._closed.wait(0.2):
+            for worker_id, worker in list(self._workers.items()):
+                if not worker["process"].is_alive() and not self._closed.is_set():
+                    self._on_death(worker_id)
+
+    def _on_death(self, worker_id: str):
+        lost = []
+        with self._lock:
+            worker = self._workers.pop(worker_id, None)
+            if worker is None:
+                return
+            self.stats["worker_deaths"] += 1
+            print(f"\n Worker {worker_id} (pid {worker['pid']}) died with exit code "
+                  f"{worker['process'].exitcode}; {worker['in_flight']} requests in flight")
+            worker["responses"].put(None)
+            # Its sessions move to the neighbouring workers on the ring (their memory is lost)
+            self.ring.remove(worker_id)
+            for request_id, (owner, kind, payload, future) in list(self._pending.items()):
+                if owner != worker_id:
+                    continue
+                del self._pending[request_id]
+                if kind == "process":
+                    self.stats["rerouted"] += 1
+                    self._send(request_id, kind, payload, future)
+                else:
+                    lost.append(future)
+            self.stats["lost"] += len(lost)
+        for future in lost:
+            future.set_exception(WorkerDied(f"Worker {worker_id} died"))
+
+        if not self.respawn:
+            return
+        # Requests keep flowing to the other workers while the replacement starts
+        replacement = self._start_process(worker_id)
+        with self._lock:
+            closed = self._closed.is_set()
+            if not closed:
+                self._register(worker_id, replacement)
+                self.stats["respawns"] += 1
+        if closed:
+            replacement["process"].terminate()
+
+    def get_statistics(self, timeout: float = 5.0) -> Dict[str, Any]:
+        """Collects metrics from all ready workers and aggregates them"""
+        futures = {}
+        with self._lock:
+            for worker_id in self.ring.nodes:
+                futures[worker_id] = Future()
+                self._send(next(self._ids), "stats", {}, futures[worker_id], worker_id)
+            stats = dict(self.stats)
+            in_flight = {worker_id: worker["in_flight"] for worker_id, worker in self._workers.items()}
+
+        workers = {}
+        for worker_id, future in futures.items():
+            try:
+                workers[worker_id] = future.result(timeout)
+            except Exception as e:
+                workers[worker_id] = {"error": str(e)}
+            workers[worker_id]["in_flight"] = in_flight.get(worker_id, 0)
+
+        # Percentiles cannot be merged exactly: the slowest worker's p95 is reported per node
+        node_p95: Dict[str, float] = {}
+        deadline_hits: Dict[str, int] = {}
+        coalescing = {"calls": 0, "executions": 0, "coalesced": 0}
+        for worker in workers.values():
+            for node, node_stats in worker.get("nodes", {}).items():
+                node_p95[node] = max(node_p95.get(node, 0.0), node_stats["p95"])
+            for stage, hits in worker.get("deadline_hits", {}).items():
+                deadline_hits[stage] = deadline_hits.get(stage, 0) + hits
+            for key in coalescing:
+                coalescing[key] += worker.get("coalescing", {}).get(key, 0)
+
+        stats.update({
+            "workers": workers,
+            "alive": len(self.ring),
+            "served": sum(worker.get("served", 0) for worker in workers.values()),
+            "sessions": sum(worker.get("sessions", 0) for worker in workers.values()),
+            "node_p95": node_p95,
+            "deadline_hits": deadline_hits,
+            "coalescing": coalescing,
+            "p50": self.latency.percentile(50),
+            "p95": self.latency.percentile(95)
+        })
+        return stats
+
+    def close(self, timeout: float = 10.0):
+        """Stops workers after their queued requests"""
+        self._closed.set()
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            worker["requests"].put(None)
+        for worker in workers:
+            worker["process"].join(timeout)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+            worker["responses"].put(None)
+
+    def __enter__(self) -> "WorkerPool":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()